@@ -0,0 +1,76 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from indset.generate import generate_random_alignment_grid
+from indset.plot.gifsink import GifSink, read_gif_frames
+from indset.plot.plot_pil import RasterPlotter, SHAPES, SPRITES, HEATMAP
+from indset.simulate import AlignmentSimulator, ArrayMap
+
+
+def check_frames(frames, filename, downscale=1):
+    # Writes frames through a GifSink, decodes the file again and returns the numbers of the frames that differ.
+    # Frames identical to their predecessor are merged by the sink, so they are left out of the comparison.
+    sink = GifSink(filename, downscale=downscale)
+    expected = []
+    for frame in frames:
+        sink.append(frame)
+
+        frame = np.asarray(frame)[::downscale, ::downscale, :3]
+        if not expected or (frame != expected[-1]).any():
+            expected.append(frame)
+    sink.close()
+
+    decoded = read_gif_frames(filename)
+    if len(decoded) != len(expected):
+        return range(max(len(decoded), len(expected)))
+
+    return [n for n, (got, frame) in enumerate(zip(decoded, expected)) if (got != frame).any()]
+
+
+def plotter_frames(mode, size, particles, frames, iterations_per_frame, seed):
+    grid = generate_random_alignment_grid(particles, size=(size, size), map_backend=ArrayMap, seed=seed)
+    sim = AlignmentSimulator(grid, 4.0, seed=seed)
+    directory = tempfile.mkdtemp()
+
+    try:
+        plotter = RasterPlotter(sim, directory, write_gif=False, mode=mode)
+        for _ in xrange(frames):
+            if mode == HEATMAP:
+                yield plotter.rasterize_heatmap()
+            else:
+                yield plotter.rasterize_sprites()
+            sim.run_iterations(iterations_per_frame)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write RasterPlotter frames through GifSink, decode the GIF again "
+                                                 "and report every frame that does not match its input.")
+    parser.add_argument("--size", type=int, default=30)
+    parser.add_argument("--particles", type=int, default=150)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--iterations-per-frame", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    failures = 0
+    try:
+        for mode in [HEATMAP, SPRITES]:
+            for downscale in [1, 2]:
+                frames = plotter_frames(mode, args.size, args.particles, args.frames, args.iterations_per_frame,
+                                        args.seed)
+                mismatches = check_frames(frames, os.path.join(directory, "check.gif"), downscale)
+                failures += len(mismatches)
+                print "%-8s downscale %d: %d mismatched frames" % (mode, downscale, len(mismatches))
+    finally:
+        shutil.rmtree(directory)
+
+    sys.exit(1 if failures else 0)
@@ -1,18 +1,34 @@
 import os
 import shutil
 
+
+def latest_frame(dir):
+    # The frame with the highest iteration number, or None; files that aren't numbered frames are skipped
+    latest_number, latest_file = None, None
+    for f in os.listdir(dir):
+        stem = os.path.splitext(f)[0]
+        if not stem.isdigit() or not os.path.isfile(os.path.join(dir, f)):
+            continue
+
+        if latest_number is None or int(stem) > latest_number:
+            latest_number, latest_file = int(stem), f
+
+    return latest_file
+
+
 def flatten(p):
     dir_list = next(os.walk(p))[1]
 
     for dir in dir_list:
         dir = os.path.join(p, dir)
-        files_by_number = {int(os.path.splitext(os.path.basename(f))[0]): f for f in os.listdir(dir) if os.path.isfile(os.path.join(dir, f))}
 
-        max_file = max(files_by_number.values(), key=lambda x: files_by_number.keys()[files_by_number.values().index(x)])
+        max_file = latest_frame(dir)
+        if max_file is None:
+            continue
         ext = os.path.splitext(os.path.basename(max_file))[1]
 
         shutil.copy(os.path.join(dir, max_file), os.path.join(p, dir + ext))
 
 if __name__ == "__main__":
     flatten(".")
-    print "Done!"
\ No newline at end of file
+    print "Done!"
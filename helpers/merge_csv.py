@@ -1,13 +1,133 @@
+import argparse
+import multiprocessing
 import os
+import re
+import shutil
+import sys
+
 import pandas
 
-def merge_csv(p):
-    dir_list = next(os.walk(p))[1]
+from flatten import latest_frame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from indset.io import read_metrics
+
+RUN_PATTERN = re.compile(r"^lambda-(?P<bias>[0-9.]+)--seed-(?P<seed>\d+)$")
+INDEX = ["Model", "Bias", "Seed", "Iterations"]
+
+
+def find_runs(p):
+    # Sweep output is laid out as p/<model>/lambda-<bias>--seed-<seed>
+    runs = []
+    for model in sorted(os.listdir(p)):
+        model_dir = os.path.join(p, model)
+        if not os.path.isdir(model_dir):
+            continue
+
+        for run in os.listdir(model_dir):
+            match = RUN_PATTERN.match(run)
+            if match is not None:
+                runs.append((model, float(match.group("bias")), int(match.group("seed")), os.path.join(model_dir, run)))
+
+    return runs
+
+
+def metrics_files(run_dir):
+    metrics_dir = os.path.join(run_dir, "metrics")
+    if os.path.isdir(metrics_dir):
+        return [os.path.join(metrics_dir, f) for f in os.listdir(metrics_dir)]
+
+    csv = os.path.join(run_dir, "metrics.csv")
+    return [csv] if os.path.exists(csv) else []
+
+
+def run_signature(run_dir):
+    # Runs whose metric files have the same sizes and modification times are taken to be unchanged
+    return tuple(sorted((os.path.basename(f), os.path.getsize(f), os.path.getmtime(f))
+                        for f in metrics_files(run_dir)))
+
+
+def read_run(run):
+    model, bias, seed, run_dir = run
+
+    if os.path.isdir(os.path.join(run_dir, "metrics")):
+        df = pandas.DataFrame(read_metrics(os.path.join(run_dir, "metrics")))
+    else:
+        df = pandas.read_csv(os.path.join(run_dir, "metrics.csv"), ";")
+
+    df["Model"] = model
+    df["Bias"] = bias
+    df["Seed"] = seed
+
+    return run, run_signature(run_dir), df.set_index(INDEX)
+
+
+def merge_runs(p, output, processes=None):
+    """Merges the metrics of every run under p into one table indexed by model, bias, seed and iteration.
+
+    The table is pickled to output together with the signature of every run it holds. Merging again only reads the
+    runs that are new or whose metrics changed since, and drops the runs that are gone.
+    """
+    signatures, tables = {}, {}
+    if os.path.exists(output):
+        previous = pandas.read_pickle(output)
+        signatures = previous["signatures"]
+        if len(previous["table"]):
+            tables = dict((key, df) for key, df in previous["table"].groupby(level=[0, 1, 2], sort=False))
+
+    runs = [run for run in find_runs(p) if metrics_files(run[3])]
+    keys = set(run[:3] for run in runs)
+
+    stale = [run for run in runs if signatures.get(run[:3]) != run_signature(run[3])]
+    for key in list(signatures):
+        if key not in keys:
+            del signatures[key]
+            tables.pop(key, None)
+
+    print "%d runs found, %d to read" % (len(runs), len(stale))
+
+    if stale:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for n, (run, signature, df) in enumerate(pool.imap_unordered(read_run, stale, chunksize=16)):
+                signatures[run[:3]] = signature
+                tables[run[:3]] = df
+                if (n + 1) % 1000 == 0:
+                    print "Read %d/%d runs" % (n + 1, len(stale))
+        finally:
+            pool.close()
+            pool.join()
+
+    table = pandas.concat([tables[key] for key in sorted(tables)], sort=False) if tables else pandas.DataFrame()
+    pandas.to_pickle({"signatures": signatures, "table": table}, output)
+
+    return table
+
+
+def copy_final_frames(p, destination):
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+
+    for model, bias, seed, run_dir in find_runs(p):
+        frame = latest_frame(run_dir)
+        if frame is not None:
+            name = "%s--%s--%s" % (model, os.path.basename(run_dir), frame)
+            shutil.copy(os.path.join(run_dir, frame), os.path.join(destination, name))
+
 
-    dataframes = []
-    for dir in dir_list:
-        csv = os.path.join(p, dir, "metrics.csv")
-        df = pandas.read_csv(csv, ";", index_col=0)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the metrics of a sweep into one table.")
+    parser.add_argument("root", help="Sweep root directory")
+    parser.add_argument("--output", default=None, help="Merged table, as a pickle (default: <root>/merged.pkl)")
+    parser.add_argument("--csv", default=None, help="Also write the merged table to this CSV file")
+    parser.add_argument("--frames", default=None, help="Copy the final frame of every run into this directory")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
 
-        df_relevant = df[[df.columns[0],'Homogeneous neighborhoods']]
+    table = merge_runs(args.root, args.output or os.path.join(args.root, "merged.pkl"), args.processes)
+    if args.csv is not None:
+        table.to_csv(args.csv, ";")
+    if args.frames is not None:
+        copy_final_frames(args.root, args.frames)
 
+    print "Done!"
@@ -0,0 +1,213 @@
+# coding=utf-8
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from indset.generate import generate_random_alignment_grid
+from indset.io import alignment_simulator_grid_loader, alignment_simulator_grid_saver
+from indset.simulate import AlignmentSimulator, ListMap, ArrayMap, Directions
+
+SEED = 12345
+
+SIZES = [30, 100, 300, 1000, 2000]
+QUICK_SIZES = [30, 100]
+
+# Particles per lattice cell
+DENSITIES = [0.05, 0.1, 0.2]
+
+# Full-resolution frames take 24x24 pixels per cell, so they are only drawn up to this size
+MAX_PLOT_SIZE = 300
+
+BACKENDS = {"list": ListMap, "array": ArrayMap}
+
+Result = namedtuple("Result", ["name", "params", "seconds_per_op", "ops"])
+
+
+def measure(function, ops, min_time=0.2, repeat=3):
+    # function runs ops operations per call; returns the best time per operation over repeat rounds of at least
+    # min_time each
+    calls = 1
+    while True:
+        start = time.time()
+        for _ in xrange(calls):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed * 1.2))
+
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        start = time.time()
+        for _ in xrange(calls):
+            function()
+        best = min(best, time.time() - start)
+
+    return best / (calls * ops)
+
+
+def make_grid(size, density, backend):
+    n_particles = max(1, int(density * size * size))
+    return generate_random_alignment_grid(n_particles, size=(size, size), map_backend=BACKENDS[backend], seed=SEED)
+
+
+def grid_cases(grid, params):
+    rng = random.Random(SEED)
+    positions = [(rng.randint(grid.min[0] + 1, grid.max[0] - 1), rng.randint(grid.min[1] + 1, grid.max[1] - 1))
+                 for _ in xrange(1000)]
+
+    def get_particle():
+        for position in positions:
+            grid.get_particle(position)
+
+    def second_degree_neighbor_count():
+        for position in positions:
+            grid.second_degree_neighbor_count(position)
+
+    # Moves that are always possible: particles with an empty cell to the east, moved there and back
+    particles = list(grid.get_all_particles())
+    rng.shuffle(particles)
+    movable = []
+    for particle in particles[:1000]:
+        target = grid.get_position_in_direction(particle.axial_coordinates, Directions.E)
+        if grid.is_position_in_bounds(target) and grid.get_particle(target) is None:
+            movable.append((particle.axial_coordinates, target))
+
+    def move_particle():
+        for old, new in movable:
+            grid.move_particle(old, new)
+            grid.move_particle(new, old)
+
+    yield Result("grid.get_particle", params, measure(get_particle, len(positions)), len(positions))
+    yield Result("grid.second_degree_neighbor_count", params,
+                 measure(second_degree_neighbor_count, len(positions)), len(positions))
+    if movable:
+        yield Result("grid.move_particle", params, measure(move_particle, 2 * len(movable)), 2 * len(movable))
+
+
+def simulator_cases(size, density, backend, params):
+    engines = [("sequential", None)]
+    if backend == "array":
+        engines.append(("batched", 65536))
+
+    for engine, batch_size in engines:
+        sim = AlignmentSimulator(make_grid(size, density, backend), 4.0, seed=SEED, batch_size=batch_size)
+        iterations = 100000
+        yield Result("simulator.run_iterations", dict(params, engine=engine),
+                     measure(lambda: sim.run_iterations(iterations), iterations, repeat=1), iterations)
+
+
+def io_cases(grid, size, density, backend, params):
+    n_particles = len(list(grid.get_all_particles()))
+    yield Result("generate_random_grid", params,
+                 measure(lambda: make_grid(size, density, backend), n_particles, min_time=0, repeat=1), n_particles)
+
+    fd, filename = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        alignment_simulator_grid_saver(filename, grid)
+        yield Result("alignment_simulator_grid_loader", params,
+                     measure(lambda: alignment_simulator_grid_loader(filename, map_backend=BACKENDS[backend]),
+                             n_particles, min_time=0, repeat=1), n_particles)
+    finally:
+        os.remove(filename)
+
+
+def plot_cases(grid, size, params):
+    sim = AlignmentSimulator(grid, 4.0)
+    directory = tempfile.mkdtemp()
+
+    try:
+        from indset.plot.plot_pil import RasterPlotter, SHAPES, SPRITES, HEATMAP
+        modes = [HEATMAP] if size > MAX_PLOT_SIZE else [SHAPES, SPRITES, HEATMAP]
+        for mode in modes:
+            plotter = RasterPlotter(sim, directory, write_gif=False, mode=mode)
+            plotter.draw_plot()
+            yield Result("RasterPlotter.draw_plot", dict(params, mode=mode),
+                         measure(plotter.draw_plot, 1, min_time=0), 1)
+
+        try:
+            from indset.plot.plot_gizeh import VectorPlotter
+        except ImportError:
+            # cairo is optional; without it the vector plotter is simply not benchmarked
+            return
+
+        if size <= MAX_PLOT_SIZE:
+            plotter = VectorPlotter(sim, directory)
+            filename = os.path.join(directory, "benchmark.pdf")
+            yield Result("VectorPlotter.draw_plot", params,
+                         measure(lambda: plotter.draw_plot(filename).finish(), 1, min_time=0), 1)
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_benchmarks(sizes=SIZES, densities=DENSITIES, backends=("list", "array"), plots=True):
+    results = []
+    for size in sizes:
+        for density in densities:
+            for backend in backends:
+                params = {"size": size, "density": density, "backend": backend}
+                grid = make_grid(size, density, backend)
+
+                cases = [grid_cases(grid, params), simulator_cases(size, density, backend, params),
+                         io_cases(grid, size, density, backend, params)]
+                if plots and backend == "list":
+                    cases.append(plot_cases(grid, size, params))
+
+                for case in cases:
+                    for result in case:
+                        print "%-36s %-60s %12.3f us/op" % (result.name, format_params(result.params),
+                                                            result.seconds_per_op * 1e6)
+                        results.append(result)
+
+    return results
+
+
+def format_params(params):
+    return ", ".join("%s=%s" % item for item in sorted(params.items()))
+
+
+def save_results(filename, results):
+    data = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": SEED,
+        },
+        "results": [result._asdict() for result in results],
+    }
+
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return [Result(**result) for result in json.load(f)["results"]]
+
+
+def compare_results(old_results, new_results, threshold=0.1):
+    """Matches results by name and parameters and returns (name, params, old, new, ratio, regressed) rows, where ratio
+    is the new time per operation over the old one and regressed marks ratios above 1 + threshold."""
+    old = dict((r.name + format_params(r.params), r) for r in old_results)
+
+    rows = []
+    for result in new_results:
+        previous = old.get(result.name + format_params(result.params))
+        if previous is None:
+            continue
+
+        ratio = result.seconds_per_op / previous.seconds_per_op
+        rows.append((result.name, result.params, previous.seconds_per_op, result.seconds_per_op, ratio,
+                     ratio > 1 + threshold))
+
+    return rows
@@ -1,2 +1,3 @@
 # coding=utf-8
 from randgen import generate_random_grid, generate_random_alignment_grid
+from batch import GridSpec, generate_grid_archive, read_archive_index, load_grid_from_archive
@@ -0,0 +1,75 @@
+# coding=utf-8
+import functools
+import io
+import multiprocessing
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+
+from indset.io.gridbin import arrays_to_grid
+from indset.simulate import Particle, ListMap, ArrayMap
+from .randgen import generate_random_alignment_grid
+
+GridSpec = namedtuple("GridSpec", ["n_particles", "size", "seed"])
+
+
+def _generate_arrays(spec, particle_types):
+    grid = generate_random_alignment_grid(spec.n_particles, size=spec.size, map_backend=ArrayMap, seed=spec.seed,
+                                          base_class=particle_types[0])
+    particles = list(grid.get_all_particles())
+
+    coordinates = np.array([p.axial_coordinates for p in particles], dtype=np.int32).reshape(-1, 2)
+    types = np.array([particle_types.index(type(p)) for p in particles], dtype=np.int8)
+    return grid.size, coordinates, types
+
+
+def _write_array(archive, name, array):
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.asanyarray(array))
+    archive.writestr(name + ".npy", buf.getvalue())
+
+
+def generate_grid_archive(specs, filename, processes=None, particle_types=(Particle,)):
+    """Generates one random alignment grid per spec across a process pool and stores them all in one compressed
+    archive, readable with numpy.load. Grids are written as they arrive, so only a few are ever held in memory.
+
+    The archive holds grid_<n>_coordinates and grid_<n>_types, indices into particle_types, for every grid and an
+    index array with one (n_particles, width, height, seed) row per grid.
+    """
+    specs = list(specs)
+    pool = multiprocessing.Pool(processes)
+
+    index = []
+    archive = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    try:
+        worker = functools.partial(_generate_arrays, particle_types=particle_types)
+        for number, (size, coordinates, types) in enumerate(pool.imap(worker, specs)):
+            _write_array(archive, "grid_%d_coordinates" % number, coordinates)
+            _write_array(archive, "grid_%d_types" % number, types)
+            index.append((len(coordinates), size[0], size[1], specs[number].seed))
+            print "[%d/%d] Generated grid of %d particles" % (number + 1, len(specs), len(coordinates))
+
+        _write_array(archive, "index", np.array(index, dtype=np.int64).reshape(-1, 4))
+    finally:
+        archive.close()
+        pool.close()
+        pool.join()
+
+
+def read_archive_index(filename):
+    with np.load(filename) as archive:
+        return [GridSpec(n, (w, h), seed) for n, w, h, seed in archive["index"].tolist()]
+
+
+def load_grid_from_archive(filename, number, particle_types=(Particle,), map_backend=ListMap):
+    with np.load(filename) as archive:
+        n, width, height, seed = archive["index"][number].tolist()
+        coordinates = archive["grid_%d_coordinates" % number].reshape(-1, 2)
+
+        # Archives from before types were stored only hold particles of the first type
+        types_name = "grid_%d_types" % number
+        types = archive[types_name] if types_name in archive.files else np.zeros(len(coordinates), dtype=np.int8)
+
+    return arrays_to_grid((width, height), coordinates[:, 0], coordinates[:, 1], types, particle_types=particle_types,
+                          map_backend=map_backend)
@@ -1,12 +1,11 @@
 # coding=utf-8
 import numpy as np
-import random
-import itertools
 
-from indset.simulate import Grid, Particle, AlignmentSimulator
+from indset.simulate import Grid, Particle, AlignmentSimulator, ListMap
 
 
-def generate_random_grid(n_particles, simulator_type, weighted_particle_types, size=None):
+def generate_random_grid(n_particles, simulator_type, weighted_particle_types, size=None, map_backend=ListMap,
+                         seed=None):
     # weighted particle types is a list of particle types in (single-param initializer, weight) format
 
     if n_particles <= 0:
@@ -16,48 +15,70 @@ def generate_random_grid(n_particles, simulator_type, weighted_particle_types, s
         width_height = int(n_particles ** 0.5) * 4
         size = (width_height, width_height)
 
-    grid = Grid(size)
+    grid = Grid(size, map_backend)
     print "Initialized a grid of size %d, %d" % size
 
+    random_state = np.random.RandomState(seed)
     total_weight = float(sum(wp[1] for wp in weighted_particle_types))
 
     # Choose the classes for our particles:
-    particle_types = list(np.random.choice([wt[0] for wt in weighted_particle_types], n_particles, True,
-                                           [wt[1] / total_weight for wt in weighted_particle_types]))
+    particle_types = [weighted_particle_types[t][0] for t in
+                      random_state.choice(len(weighted_particle_types), n_particles, True,
+                                          [wt[1] / total_weight for wt in weighted_particle_types])]
 
-    # Make a list of valid positions:
-    valid_x = xrange(grid.min[0], grid.max[0] + 1)
-    valid_y = xrange(grid.min[0], grid.max[0] + 1)
-    valid_positions = [x for x in itertools.product(valid_x, valid_y) if grid.is_position_in_bounds(x)]
+    # Cells are numbered x * ny + y over the in-bounds positions
+    nx = grid.max[0] - grid.min[0] - 1
+    ny = grid.max[1] - grid.min[1] - 1
 
-    i = 0
-    for particle_type in particle_types:
-        while True:
-            # Choose a random position for the particle
-            coords = random.choice(list(valid_positions))
+    if n_particles > (nx * ny + 1) / 2:
+        raise ValueError("%d particles can't form an independent set on a %dx%d lattice." % (n_particles, nx, ny))
 
-            if grid.get_particle(coords) is not None:
-                continue
+    # Eligible cells have no particle on or next to them. slots[c] is c's index in eligible, or -1 once removed, so
+    # that a cell is dropped in O(1) by swapping the last eligible cell into its place.
+    eligible = range(nx * ny)
+    slots = range(nx * ny)
 
-            particle = particle_type(coords, i)
+    def remove(cell):
+        slot = slots[cell]
+        if slot < 0:
+            return
 
-            grid.add_particle(particle)
+        last = eligible.pop()
+        if last != cell:
+            eligible[slot] = last
+            slots[last] = slot
+        slots[cell] = -1
 
-            try:
-                simulator_type.validate_grid(grid)
-            except ValueError:
-                grid.remove_particle(particle)
-                continue
+    draws = random_state.random_sample(n_particles).tolist()
 
-            print "Successfully inserted %s #%d" % (type(particle).__name__, i)
-            i += 1
-            break
+    for i, particle_type in enumerate(particle_types):
+        if not eligible:
+            raise ValueError("The lattice was saturated after %d of %d particles." % (i, n_particles))
+
+        # Choose a random eligible position for the particle
+        cell = eligible[int(draws[i] * len(eligible))]
+        x, y = divmod(cell, ny)
+
+        remove(cell)
+        if x > 0:
+            remove(cell - ny)
+        if x < nx - 1:
+            remove(cell + ny)
+        if y > 0:
+            remove(cell - 1)
+        if y < ny - 1:
+            remove(cell + 1)
+
+        grid.add_particle(particle_type((x + grid.min[0] + 1, y + grid.min[1] + 1), i))
+
+    simulator_type.validate_grid(grid)
 
     print "Random grid generation successful"
     return grid
 
 
-def generate_random_alignment_grid(n_particles, size=None, simulator_type=AlignmentSimulator, base_class=Particle):
+def generate_random_alignment_grid(n_particles, size=None, simulator_type=AlignmentSimulator, base_class=Particle,
+                                   map_backend=ListMap, seed=None):
     classes = [(base_class, 1)]
 
-    return generate_random_grid(n_particles, simulator_type, classes, size)
+    return generate_random_grid(n_particles, simulator_type, classes, size, map_backend, seed)
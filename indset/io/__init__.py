@@ -1,3 +1,7 @@
 # coding=utf-8
 from gridtxt import alignment_simulator_grid_loader, alignment_simulator_grid_saver
+from gridbin import alignment_simulator_grid_binary_loader, alignment_simulator_grid_binary_saver, \
+    convert_text_to_binary, convert_binary_to_text, read_grid_arrays
 from save_metrics import MetricsIO
+from checkpoint import save_checkpoint, load_checkpoint
+from timeseries import MetricsRecorder, read_metrics
@@ -0,0 +1,93 @@
+# coding=utf-8
+import os
+
+import numpy as np
+
+from indset.simulate import Grid, Particle, AlignmentSimulator, ArrayMap
+
+CHECKPOINT_VERSION = 2
+
+# Version 1 checkpoints have no probability sink state; sinks resumed from them start out empty
+SUPPORTED_VERSIONS = (1, 2)
+
+SINK_PREFIX = "sink_"
+
+
+def save_checkpoint(filename, simulator, particle_types=(Particle,)):
+    grid = simulator.grid
+    particles = list(grid.get_all_particles())
+
+    # Only the tracker for whole-grid rounds is kept, since that is the one run_iterations uses
+    tracker = simulator.get_round_tracker()
+    visited = [p.id for p in particles if tracker.is_visited(p.id)]
+
+    random_version, random_internal, random_gauss = simulator.random.getstate()
+    _, np_keys, np_pos, np_has_gauss, np_cached_gaussian = simulator.random_state.get_state()
+
+    data = {
+        "version": np.array(CHECKPOINT_VERSION),
+        "size": np.array(grid.size, dtype=np.int32),
+        "ids": np.array([p.id for p in particles], dtype=np.int32),
+        "coordinates": np.array([p.axial_coordinates for p in particles], dtype=np.int32).reshape(-1, 2),
+        "types": np.array([particle_types.index(type(p)) for p in particles], dtype=np.int8),
+        "bias": np.array(simulator.bias),
+        "batch_size": np.array(simulator.batch_size or 0, dtype=np.int64),
+        "start_time": np.array(simulator.start_time),
+        "counters": np.array([simulator.iterations_run, simulator.movements, simulator.rounds], dtype=np.int64),
+        "visited": np.array(visited, dtype=np.int32),
+        "random_version": np.array(random_version),
+        "random_internal": np.array(random_internal, dtype=np.int64),
+        "random_gauss": np.array(np.nan if random_gauss is None else random_gauss),
+        "np_keys": np_keys,
+        "np_state": np.array([np_pos, np_has_gauss], dtype=np.int64),
+        "np_cached_gaussian": np.array(np_cached_gaussian),
+    }
+
+    # Sinks without get_state, such as plain lists, are not saved
+    if hasattr(simulator.probability_sink, "get_state"):
+        for key, value in simulator.probability_sink.get_state().items():
+            data[SINK_PREFIX + key] = value
+
+    # Write next to the target and rename over it, so an interrupted save never leaves a broken checkpoint
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        np.savez(f, **data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.rename(temp_filename, filename)
+
+
+def load_checkpoint(filename, particle_types=(Particle,), map_backend=ArrayMap, probability_sink=None):
+    with np.load(filename) as data:
+        if int(data["version"]) not in SUPPORTED_VERSIONS:
+            raise ValueError("Unsupported checkpoint version %d" % int(data["version"]))
+
+        grid = Grid(tuple(int(x) for x in data["size"]), map_backend)
+        for identifier, coordinates, ptype in zip(data["ids"].tolist(), data["coordinates"].tolist(),
+                                                  data["types"].tolist()):
+            grid.add_particle(particle_types[ptype](coordinates, identifier))
+
+        batch_size = int(data["batch_size"]) or None
+        simulator = AlignmentSimulator(grid, float(data["bias"]), batch_size=batch_size,
+                                       probability_sink=probability_sink)
+        simulator.start_time = str(data["start_time"])
+        simulator.iterations_run, simulator.movements, simulator.rounds = data["counters"].tolist()
+
+        sink_state = dict((key[len(SINK_PREFIX):], data[key]) for key in data.files if key.startswith(SINK_PREFIX))
+        if sink_state and hasattr(simulator.probability_sink, "set_state"):
+            simulator.probability_sink.set_state(sink_state)
+
+        tracker = simulator.get_round_tracker()
+        for identifier in data["visited"].tolist():
+            tracker.visit(identifier)
+
+        random_gauss = float(data["random_gauss"])
+        simulator.random.setstate((int(data["random_version"]), tuple(data["random_internal"].tolist()),
+                                   None if np.isnan(random_gauss) else random_gauss))
+
+        np_pos, np_has_gauss = data["np_state"].tolist()
+        simulator.random_state.set_state(("MT19937", data["np_keys"], np_pos, np_has_gauss,
+                                          float(data["np_cached_gaussian"])))
+
+    return simulator
@@ -0,0 +1,116 @@
+# coding=utf-8
+import struct
+
+import numpy as np
+
+from indset.simulate import Grid, Particle, ListMap
+
+# Little-endian header: magic, format version, width, height, particle count. The particle data follows as three
+# packed int32 columns: x coordinates, y coordinates and particle type indices.
+MAGIC = b"IGRD"
+VERSION = 1
+HEADER = struct.Struct("<4sIiiq")
+
+
+def write_grid_arrays(filename, size, x, y, types):
+    columns = np.array([x, y, types], dtype="<i4").reshape(3, -1)
+
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, size[0], size[1], columns.shape[1]))
+        f.write(columns.tobytes())
+
+
+def read_grid_arrays(filename):
+    # The columns are memory mapped, so nothing is read until they are used
+    with open(filename, "rb") as f:
+        magic, version, width, height, count = HEADER.unpack(f.read(HEADER.size))
+
+    if magic != MAGIC:
+        raise ValueError("%s is not a binary grid file" % filename)
+
+    if version != VERSION:
+        raise ValueError("Unsupported binary grid version %d" % version)
+
+    if count == 0:
+        empty = np.zeros(0, dtype="<i4")
+        return (width, height), empty, empty, empty
+
+    columns = np.memmap(filename, dtype="<i4", mode="r", offset=HEADER.size, shape=(3, count))
+    return (width, height), columns[0], columns[1], columns[2]
+
+
+def read_text_grid_arrays(filename):
+    with open(filename, "r") as f:
+        size = tuple(map(int, f.readline().split()))
+        num_particles = int(f.readline())
+        entries = [line.split() for _, line in zip(xrange(num_particles), f)]
+
+    x = np.array([int(e[0]) for e in entries], dtype=np.int32)
+    y = np.array([int(e[1]) for e in entries], dtype=np.int32)
+    types = np.array([int(e[2]) if len(e) > 2 else 0 for e in entries], dtype=np.int32)
+
+    return size, x, y, types
+
+
+def write_text_grid_arrays(filename, size, x, y, types):
+    with open(filename, "w") as f:
+        f.write("%d %d\n" % tuple(size))
+        f.write("%d\n" % len(x))
+
+        # The type column is only written when it carries information, as in the original format
+        if np.any(types != 0):
+            f.writelines("%d %d %d\n" % row for row in zip(x.tolist(), y.tolist(), types.tolist()))
+        else:
+            f.writelines("%d %d\n" % row for row in zip(x.tolist(), y.tolist()))
+
+
+def grid_to_arrays(grid, particle_types=(Particle,)):
+    particles = list(grid.get_all_particles())
+
+    x = np.array([p.axial_coordinates[0] for p in particles], dtype=np.int32)
+    y = np.array([p.axial_coordinates[1] for p in particles], dtype=np.int32)
+    types = np.array([particle_types.index(type(p)) for p in particles], dtype=np.int32)
+
+    return grid.size, x, y, types
+
+
+def arrays_to_grid(size, x, y, types, particle_types=(Particle,), map_backend=ListMap):
+    if sum(s % 2 for s in size) > 0:
+        raise ValueError("Width and height need to be even.")
+
+    # Particles are built per type in one batch and added to the grid in bulk
+    x = np.asarray(x)
+    y = np.asarray(y)
+    types = np.asarray(types)
+    present = np.unique(types).tolist()
+    if len(present) <= 1:
+        klass = particle_types[present[0] if present else 0]
+        particles = klass.create_many(zip(x.tolist(), y.tolist()), xrange(len(x)))
+    else:
+        particles = [None] * len(x)
+        for ptype in present:
+            indices = np.flatnonzero(types == ptype).tolist()
+            batch = particle_types[ptype].create_many(zip(x[indices].tolist(), y[indices].tolist()), indices)
+            for index, particle in zip(indices, batch):
+                particles[index] = particle
+
+    grid = Grid(size, map_backend)
+    grid.add_particles(particles, np.column_stack([x, y]))
+
+    return grid
+
+
+def alignment_simulator_grid_binary_loader(filename, particle_types=(Particle,), map_backend=ListMap):
+    return arrays_to_grid(*read_grid_arrays(filename), particle_types=particle_types, map_backend=map_backend)
+
+
+def alignment_simulator_grid_binary_saver(filename, grid, particle_types=(Particle,)):
+    write_grid_arrays(filename, *grid_to_arrays(grid, particle_types))
+
+
+def convert_text_to_binary(text_filename, binary_filename):
+    write_grid_arrays(binary_filename, *read_text_grid_arrays(text_filename))
+
+
+def convert_binary_to_text(binary_filename, text_filename):
+    write_text_grid_arrays(text_filename, *read_grid_arrays(binary_filename))
@@ -1,13 +1,13 @@
 # coding=utf-8
 
-from indset.simulate import Grid, Particle
+from indset.simulate import Grid, Particle, ListMap
 
 
-def alignment_simulator_grid_loader(filename, particle_types=(Particle,)):
+def alignment_simulator_grid_loader(filename, particle_types=(Particle,), map_backend=ListMap):
     f = open(filename, "r")
 
     size = tuple(map(int, f.readline().split()))
-    grid = Grid(size)
+    grid = Grid(size, map_backend)
 
     if sum(s % 2 for s in size) > 0:
         raise ValueError("Width and height need to be even.")
@@ -29,14 +29,15 @@ def alignment_simulator_grid_loader(filename, particle_types=(Particle,)):
     return grid
 
 
-def alignment_simulator_grid_saver(filename, grid):
+def alignment_simulator_grid_saver(filename, grid, particle_types=(Particle,)):
     with open(filename, 'w') as f:
         particles = list(grid.get_all_particles())
 
         f.write("%d %d\n" % tuple(grid.size))
         f.write("%d\n" % len(particles))
 
-        for particle in particles:
-            coords = particle.axial_coordinates
-
-            f.write("%d %d\n" % (coords[0], coords[1]))
+        # Particle types are written as a third column whenever there is more than one type to tell apart
+        if len(particle_types) > 1:
+            f.writelines("%d %d %d\n" % (p.axial_coordinates + (particle_types.index(type(p)),)) for p in particles)
+        else:
+            f.writelines("%d %d\n" % p.axial_coordinates for p in particles)
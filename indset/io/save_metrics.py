@@ -1,16 +1,21 @@
 # coding=utf-8
 import csv
+import os
 
 
 class MetricsIO(object):
-    def __init__(self, compression_simulator, filename):
+    def __init__(self, compression_simulator, filename, append=False):
         self.compression_simulator = compression_simulator
-        self.file = open(filename, "wb")
+
+        # Resumed runs keep adding rows to the file they started
+        append = append and os.path.exists(filename)
+        self.file = open(filename, "ab" if append else "wb")
         self.csv_writer = csv.writer(self.file, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
 
-        # Write the metric header:
-        metrics = self.compression_simulator.get_metrics()
-        self.csv_writer.writerow(["Iterations"] + [metric[0] for metric in metrics])
+        if not append:
+            # Write the metric header:
+            metrics = self.compression_simulator.get_metrics()
+            self.csv_writer.writerow(["Iterations"] + [metric[0] for metric in metrics])
 
     def save_metric(self):
         metrics = self.compression_simulator.get_metrics()
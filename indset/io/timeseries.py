@@ -0,0 +1,136 @@
+# coding=utf-8
+import json
+import os
+import re
+
+import numpy as np
+
+SCHEMA_FILE = "schema.json"
+SCHEMA_VERSION = 1
+
+ITERATIONS = "Iterations"
+
+
+def _column_file(name):
+    return re.sub(r"[^0-9A-Za-z]+", "_", name).strip("_").lower() + ".bin"
+
+
+def _column_dtype(fmt):
+    # Integer formats are stored as int64, everything else as float64
+    return "<i8" if re.match(r"^%\d*d$", fmt) else "<f8"
+
+
+def _read_schema(directory):
+    with open(os.path.join(directory, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+
+    if schema["version"] != SCHEMA_VERSION:
+        raise ValueError("Unsupported metrics schema version %d" % schema["version"])
+
+    return schema["columns"]
+
+
+def _complete_rows(directory, columns):
+    # An interrupted flush can leave some columns longer than others; only rows present in every column count
+    return min(os.path.getsize(os.path.join(directory, c["file"])) // np.dtype(c["dtype"]).itemsize
+               for c in columns)
+
+
+class MetricsRecorder(object):
+    """Samples simulator metrics into typed column files.
+
+    Each sample goes into preallocated numpy buffers, which are appended to one raw binary file per column every
+    chunk_size samples; schema.json records the column names and dtypes. metrics selects which of the simulator's
+    metrics are kept, by name, and only those are computed. With append, a resumed run continues the existing columns
+    after dropping any rows past the simulator's current iteration.
+    """
+
+    def __init__(self, simulator, directory, metrics=None, chunk_size=1024, append=False):
+        self.simulator = simulator
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+        definitions = simulator.get_metric_definitions()
+        if metrics is not None:
+            unknown = set(metrics) - set(name for name, _, _ in definitions)
+            if unknown:
+                raise ValueError("Unknown metrics: %s" % ", ".join(sorted(unknown)))
+            definitions = [d for d in definitions if d[0] in metrics]
+
+        self.columns = [{"name": ITERATIONS, "file": _column_file(ITERATIONS), "dtype": "<i8"}]
+        self.columns += [{"name": name, "file": _column_file(name), "dtype": _column_dtype(fmt)}
+                         for name, fmt, _ in definitions if name != ITERATIONS]
+        self.functions = [function for name, _, function in definitions if name != ITERATIONS]
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        append = append and os.path.exists(os.path.join(directory, SCHEMA_FILE))
+        if append:
+            if _read_schema(directory) != self.columns:
+                raise ValueError("The metrics in %s were recorded with different columns." % directory)
+            self._truncate()
+        else:
+            with open(os.path.join(directory, SCHEMA_FILE), "w") as f:
+                json.dump({"version": SCHEMA_VERSION, "columns": self.columns}, f, indent=2)
+
+        self.files = [open(os.path.join(directory, c["file"]), "ab" if append else "wb") for c in self.columns]
+        self.buffers = [np.empty(chunk_size, dtype=c["dtype"]) for c in self.columns]
+        self.count = 0
+
+    def _truncate(self):
+        iterations_file = os.path.join(self.directory, self.columns[0]["file"])
+        rows = _complete_rows(self.directory, self.columns)
+        iterations = np.fromfile(iterations_file, dtype="<i8", count=rows)
+        rows = int(np.searchsorted(iterations, self.simulator.iterations_run, side="right"))
+
+        for column in self.columns:
+            with open(os.path.join(self.directory, column["file"]), "r+b") as f:
+                f.truncate(rows * np.dtype(column["dtype"]).itemsize)
+
+    def record(self):
+        row = self.count
+        self.buffers[0][row] = self.simulator.iterations_run
+        for buf, function in zip(self.buffers[1:], self.functions):
+            buf[row] = function()
+
+        self.count += 1
+        if self.count == self.chunk_size:
+            self.flush()
+
+    def run_iterations(self, iterations, interval, classes_to_move=None):
+        # Runs the simulator, recording a sample every interval iterations
+        remaining = iterations
+        while remaining > 0:
+            step = min(interval, remaining)
+            self.simulator.run_iterations(step, classes_to_move)
+            self.record()
+            remaining -= step
+
+    def flush(self):
+        for f, buf in zip(self.files, self.buffers):
+            f.write(buf[:self.count].tobytes())
+            f.flush()
+
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+
+def read_metrics(directory, mmap=False):
+    # Returns the recorded columns as a dict of arrays, keyed by metric name
+    columns = _read_schema(directory)
+    rows = _complete_rows(directory, columns)
+
+    metrics = {}
+    for column in columns:
+        path = os.path.join(directory, column["file"])
+        if mmap and rows > 0:
+            metrics[column["name"]] = np.memmap(path, dtype=column["dtype"], mode="r", shape=(rows,))
+        else:
+            metrics[column["name"]] = np.fromfile(path, dtype=column["dtype"], count=rows)
+
+    return metrics
@@ -1,4 +1,11 @@
 # coding=utf-8
 from plot_pil import RasterPlotter
-from plot_gizeh import VectorPlotter
 
+try:
+    from plot_gizeh import VectorPlotter
+except ImportError:
+    # VectorPlotter needs cairo, which is optional
+    pass
+
+from pipeline import PlotPipeline, PlotSnapshot
+from gifsink import GifSink
@@ -0,0 +1,208 @@
+# coding=utf-8
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+# Disposal method 1 leaves each frame in place, so a frame only has to cover the region that changed
+DISPOSAL_KEEP = 1
+
+
+def _read_sub_blocks(data, position):
+    start = position
+    while data[position] != b"\x00":
+        position += ord(data[position]) + 1
+
+    return data[start:position + 1], position + 1
+
+
+def _encode_indices(indices, palette_bytes):
+    # PIL does the LZW compression: the image data of a single-frame GIF is cut out and reused as is
+    image = Image.fromarray(indices, "P")
+    image.putpalette(palette_bytes)
+
+    buf = io.BytesIO()
+    image.save(buf, "GIF", optimize=False, interlace=False)
+    data = buf.getvalue()
+
+    flags = ord(data[10])
+    position = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+    while True:
+        block = data[position]
+        if block == b"\x21":
+            _, position = _read_sub_blocks(data, position + 2)
+        elif block == b"\x2c":
+            flags = ord(data[position + 9])
+            position += 10 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+            image_data, _ = _read_sub_blocks(data, position + 1)
+
+            # The interlace flag has to carry over to the descriptor the data ends up under
+            return flags & 0x40, data[position] + image_data
+        else:
+            raise ValueError("Unexpected block in GIF data")
+
+
+class GifSink(object):
+    """Writes an animated GIF frame by frame without keeping the frames around.
+
+    The palette is fixed once, from the given colors or from the first frame, and every frame is mapped onto it
+    by binary search over the sorted packed RGB values of the colors seen so far. Each frame only stores the bounding
+    box of the pixels that changed since the previous one, and a frame identical to its predecessor just extends its
+    display time. The last frame is held back until close, which can give it its own duration. downscale keeps every
+    n-th pixel in both directions.
+    """
+
+    def __init__(self, filename, duration=0.5, downscale=1, palette=None, loop=0):
+        self.file = open(filename, "wb")
+        self.duration = duration
+        self.downscale = downscale
+        self.loop = loop
+
+        self.palette = None if palette is None else np.array(palette, dtype=np.uint8).reshape(-1, 3)
+        self.known_keys = None
+        self.known_indices = None
+
+        self.previous = None
+        self.held = None
+        self.held_duration = 0
+        self.frames = 0
+        self.closed = False
+
+    def _set_palette(self, frame):
+        if self.palette is None:
+            colors = np.unique(self._pack(frame))
+            if len(colors) <= 256:
+                self.palette = np.column_stack([colors >> 16, (colors >> 8) & 0xFF, colors & 0xFF]).astype(np.uint8)
+            else:
+                quantized = Image.fromarray(frame).quantize(256)
+                self.palette = np.array(quantized.getpalette()[:768], dtype=np.uint8).reshape(-1, 3)
+
+        # The table size is rounded up to a power of two, as the format requires
+        self.table_bits = max(1, int(np.ceil(np.log2(len(self.palette)))))
+        table = np.zeros((1 << self.table_bits, 3), dtype=np.uint8)
+        table[:len(self.palette)] = self.palette
+        self.palette_bytes = table.tobytes()
+
+        # Sorted packed RGB values with their palette indices, extended as new colors show up
+        self.known_keys = np.array([], dtype=np.int32)
+        self.known_indices = np.array([], dtype=np.uint8)
+        self._learn(self._pack(self.palette), np.arange(len(self.palette)))
+
+    @staticmethod
+    def _pack(rgb):
+        rgb = rgb.astype(np.int32)
+        return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+    def _learn(self, keys, indices):
+        keys, first = np.unique(keys, return_index=True)
+        keys = np.concatenate([self.known_keys, keys])
+        indices = np.concatenate([self.known_indices, np.asarray(indices, dtype=np.uint8)[first]])
+
+        order = keys.argsort(kind="mergesort")
+        self.known_keys = keys[order]
+        self.known_indices = indices[order]
+
+    def _find(self, keys):
+        positions = np.searchsorted(self.known_keys, keys).clip(max=len(self.known_keys) - 1)
+        return positions, self.known_keys[positions] == keys
+
+    def _to_indices(self, frame):
+        keys = self._pack(frame)
+        positions, found = self._find(keys)
+
+        if not found.all():
+            # Colors outside the palette go to the nearest palette entry
+            new_keys = np.unique(keys[~found])
+            new_colors = np.column_stack([new_keys >> 16, (new_keys >> 8) & 0xFF, new_keys & 0xFF])
+            distances = ((new_colors[:, np.newaxis, :] - self.palette[np.newaxis, :, :].astype(np.int32)) ** 2).sum(2)
+            self._learn(new_keys, distances.argmin(axis=1))
+            positions, _ = self._find(keys)
+
+        return self.known_indices[positions]
+
+    def _write_header(self, width, height):
+        self.file.write(b"GIF89a")
+        self.file.write(struct.pack("<HHBBB", width, height, 0xF0 | (self.table_bits - 1), 0, 0))
+        self.file.write(self.palette_bytes)
+
+        # NETSCAPE2.0 extension for looping
+        self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+    def _write_held(self, duration):
+        left, top, width, height, (interlace, image_data) = self.held
+
+        delay = min(65535, int(round(duration * 100)))
+        self.file.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, DISPOSAL_KEEP << 2, delay, 0, 0))
+        self.file.write(struct.pack("<BHHHHB", 0x2C, left, top, width, height, interlace))
+        self.file.write(image_data)
+
+    def append(self, frame, duration=None):
+        if self.closed:
+            raise ValueError("This sink has been closed.")
+
+        frame = np.asarray(frame)[::self.downscale, ::self.downscale, :3]
+        duration = self.duration if duration is None else duration
+
+        if self.known_keys is None:
+            if frame.shape[1] < 2:
+                raise ValueError("GIF frames need to be at least 2 pixels wide.")
+            self._set_palette(frame)
+            self._write_header(frame.shape[1], frame.shape[0])
+
+        indices = self._to_indices(frame)
+
+        if self.previous is None:
+            top, left, bottom, right = 0, 0, indices.shape[0], indices.shape[1]
+        else:
+            changed = indices != self.previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+            if len(rows) == 0:
+                # Nothing changed, so the held frame just stays up for longer
+                self.held_duration += duration
+                return
+
+            top, bottom = rows[0], rows[-1] + 1
+            left, right = columns[0], columns[-1] + 1
+
+            # PIL writes broken image data for images one pixel wide, so regions are always at least two wide
+            if right - left < 2:
+                if right < indices.shape[1]:
+                    right += 1
+                else:
+                    left -= 1
+
+        if self.held is not None:
+            self._write_held(self.held_duration)
+
+        region = np.ascontiguousarray(indices[top:bottom, left:right])
+        self.held = (left, top, right - left, bottom - top, _encode_indices(region, self.palette_bytes))
+        self.held_duration = duration
+        self.previous = indices
+        self.frames += 1
+
+    def close(self, final_duration=None):
+        if self.closed:
+            return
+
+        if self.held is not None:
+            self._write_held(self.held_duration if final_duration is None else final_duration)
+
+        self.file.write(b"\x3b")
+        self.file.close()
+        self.closed = True
+
+
+def read_gif_frames(filename):
+    # Decodes every frame of an animated GIF, with earlier frames shown through as the disposal methods require
+    image = Image.open(filename)
+    frames = []
+    try:
+        while True:
+            frames.append(np.array(image.convert("RGB")))
+            image.seek(image.tell() + 1)
+    except EOFError:
+        pass
+
+    return frames
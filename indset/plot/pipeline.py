@@ -0,0 +1,161 @@
+# coding=utf-8
+import multiprocessing
+import os
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+from PIL import Image
+
+from indset.simulate import Grid
+from .gifsink import GifSink
+from .plot_pil import RasterPlotter, FINAL_FRAME_DURATION
+
+
+class PlotSnapshot(namedtuple("PlotSnapshot", ["size", "ids", "coordinates", "types", "particle_types", "metrics",
+                                               "start_time", "algorithm_name", "iterations_run"])):
+    """Immutable, picklable copy of everything a plotter reads from a simulator."""
+    __slots__ = ()
+
+    @classmethod
+    def from_simulator(cls, simulator):
+        particles = list(simulator.grid.get_all_particles())
+
+        particle_types = []
+        types = []
+        for p in particles:
+            if type(p) not in particle_types:
+                particle_types.append(type(p))
+            types.append(particle_types.index(type(p)))
+
+        return cls(size=simulator.grid.size,
+                   ids=np.array([p.id for p in particles], dtype=np.int32),
+                   coordinates=np.array([p.axial_coordinates for p in particles], dtype=np.int32).reshape(-1, 2),
+                   types=np.array(types, dtype=np.int8),
+                   particle_types=tuple(particle_types),
+                   metrics=tuple(tuple(metric) for metric in simulator.get_metrics()),
+                   start_time=simulator.start_time,
+                   algorithm_name=type(simulator).__name__,
+                   iterations_run=simulator.iterations_run)
+
+    def build_grid(self):
+        grid = Grid(self.size)
+        for identifier, position, ptype in zip(self.ids.tolist(), self.coordinates.tolist(), self.types.tolist()):
+            grid.add_particle(self.particle_types[ptype](position, identifier))
+
+        return grid
+
+
+class SnapshotSimulator(object):
+    # Stands in for the simulator when a plotter draws a snapshot
+    def __init__(self, snapshot):
+        self.grid = snapshot.build_grid()
+        self.start_time = snapshot.start_time
+        self.algorithm_name = snapshot.algorithm_name
+        self.iterations_run = snapshot.iterations_run
+        self.metrics = list(snapshot.metrics)
+
+    def get_metrics(self, classes_to_move=None):
+        return self.metrics
+
+
+# Each worker keeps one plotter per output directory, so fonts and sizes are only set up once
+_worker_state = threading.local()
+
+
+def _render(plotter_type, path, plotter_options, snapshot, filename):
+    plotters = getattr(_worker_state, "plotters", None)
+    if plotters is None:
+        plotters = _worker_state.plotters = {}
+
+    simulator = SnapshotSimulator(snapshot)
+
+    plotter = plotters.get((plotter_type, path))
+    if plotter is None:
+        plotter = plotters[(plotter_type, path)] = plotter_type(simulator, path, **plotter_options)
+
+    plotter.compression_simulator = simulator
+    plotter.plot(filename)
+
+    return os.path.join(path, filename)
+
+
+def _write_gif(gif_path, frame_paths, duration, final_duration, downscale):
+    sink = GifSink(gif_path, duration, downscale)
+    for frame_path in frame_paths:
+        sink.append(np.array(Image.open(frame_path).convert("RGB")))
+
+    sink.close(final_duration)
+
+    return gif_path
+
+
+class PlotPipeline(object):
+    """Renders plots of a running simulation in background workers.
+
+    plot() only takes a PlotSnapshot of the simulator and queues it, so the simulation does not wait for drawing or
+    encoding. At most max_pending frames are in flight; beyond that plot() waits for the oldest one to finish, which
+    keeps memory bounded when frames are requested faster than they can be drawn. Workers are processes, so the
+    pipeline cannot run inside a daemonic process, which may not start processes of its own.
+
+    With a gif_path, the frames written by a raster plotter are assembled into an animated GIF on close.
+    """
+
+    def __init__(self, simulator, plotter_type, path, processes=1, max_pending=None, gif_path=None,
+                 gif_duration=0.5, gif_final_duration=FINAL_FRAME_DURATION, gif_downscale=1, **plotter_options):
+        if multiprocessing.current_process().daemon:
+            raise ValueError("PlotPipeline needs render processes, which a daemonic process cannot start")
+
+        if gif_path is not None and not issubclass(plotter_type, RasterPlotter):
+            raise ValueError("Only RasterPlotter frames can be assembled into a GIF")
+
+        self.simulator = simulator
+        self.plotter_type = plotter_type
+        self.path = path
+        self.plotter_options = plotter_options
+        if issubclass(plotter_type, RasterPlotter):
+            plotter_options.setdefault("write_gif", False)
+
+        self.max_pending = max_pending or 2 * processes
+        self.gif_path = gif_path
+        self.gif_duration = gif_duration
+        self.gif_final_duration = gif_final_duration
+        self.gif_downscale = gif_downscale
+
+        self.pool = multiprocessing.Pool(processes)
+
+        self.pending = deque()
+        self.frames = []
+        self.closed = False
+
+    def _collect(self, block):
+        # Results are collected in order, which also surfaces errors raised in the workers
+        while self.pending and (block or self.pending[0].ready()):
+            self.frames.append(self.pending.popleft().get())
+            block = block and len(self.pending) >= self.max_pending
+
+    def plot(self, filename):
+        if self.closed:
+            raise ValueError("This pipeline has been closed.")
+
+        self._collect(len(self.pending) >= self.max_pending)
+
+        snapshot = PlotSnapshot.from_simulator(self.simulator)
+        self.pending.append(self.pool.apply_async(_render, (self.plotter_type, self.path, self.plotter_options,
+                                                            snapshot, filename)))
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            while self.pending:
+                self.frames.append(self.pending.popleft().get())
+
+            if self.gif_path is not None:
+                self.pool.apply(_write_gif, (self.gif_path, self.frames, self.gif_duration, self.gif_final_duration,
+                                             self.gif_downscale))
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.closed = True
@@ -1,4 +1,5 @@
 # coding=utf-8
+import math
 import threading
 
 import numpy as np
@@ -6,7 +7,6 @@ import os
 import time
 import imageio
 import errno
-import gizeh
 import cairocffi as cairo
 
 axial_to_pixel_mat = np.array([[1, 0], [0, 1]])
@@ -48,7 +48,7 @@ def mkdir_p(path):
 
 
 class PDFS(object):
-    """Simple class to allow gizeh to create pdf figures"""
+    """A cairo PDF surface holding a single figure"""
 
     def __init__(self, name, width, height):
         self.width = width
@@ -87,60 +87,76 @@ class VectorPlotter(object):
             self.path = path
         mkdir_p(self.path)
 
+        self.lattice_tile = None
         self.closed = False
 
     def get_position_from_axial(self, axial_coordinates):
         return axial_to_pixel_mat.dot(axial_coordinates) * CIRCLE_DIST + self.center
 
+    def get_lattice_tile(self):
+        # One lattice cell with its empty position in the middle. Painted as a repeating pattern, the PDF holds the
+        # dot once as a tiling pattern, so the size of a frame no longer grows with the area of the grid.
+        if self.lattice_tile is not None:
+            return self.lattice_tile
+
+        self.lattice_tile = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, (0, 0, CIRCLE_DIST, CIRCLE_DIST))
+        context = cairo.Context(self.lattice_tile)
+        context.arc(CIRCLE_DIST / 2.0, CIRCLE_DIST / 2.0, EMPTY_POSITION_RADIUS, 0, 2 * math.pi)
+        context.set_source_rgb(*EMPTY_POSITION_COLOR)
+        context.fill()
+
+        return self.lattice_tile
+
+    def draw_static_layer(self, context):
+        grid = self.compression_simulator.grid
+
+        # The empty positions run from min + 1 to max - 1 in both directions
+        first = self.get_position_from_axial(np.array(grid.min) + 1) - CIRCLE_DIST / 2.0
+        extent = (np.array(grid.max) - grid.min - 1) * CIRCLE_DIST
+
+        context.set_source_surface(self.get_lattice_tile(), first[0], first[1])
+        context.get_source().set_extend(cairo.EXTEND_REPEAT)
+        context.rectangle(first[0], first[1], extent[0], extent[1])
+        context.fill()
+
+        boundary_positions = [tuple(self.get_position_from_axial(e)) for e in grid.extrema]
+        context.move_to(*boundary_positions[0])
+        for position in boundary_positions[1:]:
+            context.line_to(*position)
+        context.close_path()
+        context.set_line_width(EDGE_WIDTH)
+        context.set_source_rgb(*BORDER_COLOR)
+        context.stroke()
+
     def draw_plot(self, path):
         if self.closed:
             raise ValueError("This plotter has been closed.")
 
         surface = PDFS(name=path, width=self.size[0], height=self.size[1])
-
-        # Here we populate the isometric grid
-        for x in xrange(self.compression_simulator.grid.min[0] + 1,
-                        self.compression_simulator.grid.max[0]):
-            for y in xrange(self.compression_simulator.grid.min[1] + 1,
-                            self.compression_simulator.grid.max[1]):
-                axial_position = np.array([x, y])
-
-                position = self.get_position_from_axial(axial_position)
-                circle = gizeh.circle(r=EMPTY_POSITION_RADIUS, xy=position, fill=EMPTY_POSITION_COLOR)
-                circle.draw(surface)
-
-        boundary_positions = [tuple(self.get_position_from_axial(e)) for e in self.compression_simulator.grid.extrema]
-        boundary_positions.append(boundary_positions[0])
-
-        boundary = gizeh.polyline(points=boundary_positions, stroke_width=EDGE_WIDTH, stroke=BORDER_COLOR)
-        boundary.draw(surface)
-
-        drawn_particles = {}
-
-        # This part draws the particles & their links
-        for particle in self.compression_simulator.grid.get_all_particles():
-            position = tuple(self.get_position_from_axial(particle.axial_coordinates))
-
-            is_even = (sum(particle.axial_coordinates) % 2 == 0)
-            width = LONG_EDGE if is_even else SHORT_EDGE
-            height = SHORT_EDGE if is_even else LONG_EDGE
-            color = EVEN_COLOR if is_even else ODD_COLOR
-
-            vertices = [
-                (position[0] - width, position[1]),
-                (position[0], position[1] + height),
-                (position[0] + width, position[1]),
-                (position[0], position[1] - height),
-                (position[0] - width, position[1])
-            ]
-
-            particle = gizeh.polyline(points=vertices, stroke_width=CIRCLE_STROKE, stroke=STROKE_COLOR, fill=color)
-            particle.draw(surface)
-
-            #gizeh.text("%d" % self.compression_simulator.grid.neighbor_count(particle.axial_coordinates), fontfamily="Impact", fontsize=CIRCLE_RADIUS,
-            #           fill=(1, 1, 1), xy=tuple_position).draw(surface)
-
-            drawn_particles[particle] = True
+        context = surface.get_new_context()
+
+        self.draw_static_layer(context)
+
+        coordinates = np.array([p.axial_coordinates for p in self.compression_simulator.grid.get_all_particles()],
+                               dtype=int).reshape(-1, 2)
+        positions = coordinates.dot(axial_to_pixel_mat.T) * CIRCLE_DIST + self.center
+        is_even = coordinates.sum(axis=1) % 2 == 0
+
+        # Particles are drawn as one path per colour class; they never overlap, so the draw order does not matter
+        context.set_line_width(CIRCLE_STROKE)
+        for selection, width, height, color in [(is_even, LONG_EDGE, SHORT_EDGE, EVEN_COLOR),
+                                                (~is_even, SHORT_EDGE, LONG_EDGE, ODD_COLOR)]:
+            for x, y in positions[selection].tolist():
+                context.move_to(x - width, y)
+                context.line_to(x, y + height)
+                context.line_to(x + width, y)
+                context.line_to(x, y - height)
+                context.close_path()
+
+            context.set_source_rgb(*color)
+            context.fill_preserve()
+            context.set_source_rgb(*STROKE_COLOR)
+            context.stroke()
 
         # start = self.get_position_from_axial(self.compression_simulator.grid.max)
         # start = np.array([self.size[0] - start[0], start[1]])
@@ -4,10 +4,11 @@ import threading
 import numpy as np
 import os
 import time
-import imageio
 import errno
 from PIL import Image, ImageDraw, ImageFont
 
+from .gifsink import GifSink
+
 axial_to_pixel_mat = np.array([[1, 0], [0, 1]])
 
 # Circles in 24x24 bounding boxes
@@ -22,6 +23,18 @@ EDGE_WIDTH = 4
 # Text size as a multiple of the screen height
 TEXT_FACTOR = 100.0
 
+# Drawing modes: PIL shapes per particle, sprites stamped with numpy, or one pixel per grid cell
+SHAPES = "shapes"
+SPRITES = "sprites"
+HEATMAP = "heatmap"
+
+# The final frame stays up as long as ten regular frames
+FRAME_DURATION = 0.5
+FINAL_FRAME_DURATION = 10 * FRAME_DURATION
+
+BACKGROUND_COLOR = (255, 255, 255)
+EDGE_COLOR = (100, 100, 100)
+
 
 def mkdir_p(path):
     try:
@@ -39,13 +52,17 @@ def save_plt(plot, filename):
 
 
 class RasterPlotter(object):
-    def __init__(self, compression_simulator, path=None, gif_path=None):
+    def __init__(self, compression_simulator, path=None, gif_path=None, write_gif=True, mode=SHAPES, gif_downscale=1):
         self.compression_simulator = compression_simulator
+        self.mode = mode
 
         self.min_pos = axial_to_pixel_mat.dot(compression_simulator.grid.min - np.array([1, 1])) * CIRCLE_DIST
         self.max_pos = axial_to_pixel_mat.dot(compression_simulator.grid.max + np.array([1, 1])) * CIRCLE_DIST
 
-        self.size = (self.max_pos - self.min_pos).astype(int)
+        if mode == HEATMAP:
+            self.size = np.array(compression_simulator.grid.max) - compression_simulator.grid.min + 1
+        else:
+            self.size = (self.max_pos - self.min_pos).astype(int)
         self.center = self.size / 2
         # self.font = FONT
         self.font = ImageFont.truetype(os.path.join(os.path.dirname(os.path.realpath(__file__)), "cmunorm.ttf"),
@@ -63,24 +80,84 @@ class RasterPlotter(object):
             self.path = path
         mkdir_p(self.path)
 
+        # Plotters driven by a PlotPipeline leave the GIF to the pipeline
         self.gif_path = gif_path
-        self.gif_writer = imageio.get_writer(self.gif_path, mode="I", duration=0.5)
+        self.gif_writer = GifSink(self.gif_path, FRAME_DURATION, gif_downscale) if write_gif else None
+
+        self.background = None
+        self.sprite_offsets = None
+        self.edge_offsets = None
 
         self.closed = False
 
     def get_position_from_axial(self, axial_coordinates):
         return axial_to_pixel_mat.dot(axial_coordinates) * CIRCLE_DIST + self.center
 
-    def draw_plot(self):
-        if self.closed:
-            raise ValueError("This plotter has been closed.")
+    def get_particle_layers(self):
+        # Particle coordinates as an array per color
+        layers = {}
+        for particle in self.compression_simulator.grid.get_all_particles():
+            layers.setdefault(particle.get_color(), []).append(particle.axial_coordinates)
 
-        plt = Image.new('RGB', tuple(self.size), (255, 255, 255))
+        return [(color, np.array(coordinates, dtype=int)) for color, coordinates in layers.iteritems()]
 
-        draw = ImageDraw.Draw(plt)
+    def rasterize_heatmap(self):
+        grid = self.compression_simulator.grid
+        frame = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        frame[:] = BACKGROUND_COLOR
 
-        drawn_hexagons = {}
+        for color, coordinates in self.get_particle_layers():
+            frame[coordinates[:, 1] - grid.min[1], coordinates[:, 0] - grid.min[0]] = color
+
+        return frame
+
+    def prepare_sprites(self):
+        # The border, the particle circle and the edge bars are drawn once with PIL and then only copied around
+        plt = Image.new('RGB', tuple(self.size), BACKGROUND_COLOR)
+        self.draw_border(ImageDraw.Draw(plt))
+        self.background = np.array(plt)
+
+        sprite = Image.new('L', tuple(CIRCLE_BOUNDING + 1), 0)
+        ImageDraw.Draw(sprite).ellipse([(0, 0), tuple(CIRCLE_BOUNDING)], 255)
+        rows, columns = np.nonzero(np.array(sprite))
+        self.sprite_offsets = (rows - CIRCLE_BOUNDING[1] / 2, columns - CIRCLE_BOUNDING[0] / 2)
+
+        # Horizontal bars from a particle to its right neighbor; transposed for the upper neighbor
+        along, across = np.meshgrid(np.arange(CIRCLE_DIST + 1), np.arange(EDGE_WIDTH) - EDGE_WIDTH / 2)
+        self.edge_offsets = (across.ravel(), along.ravel())
+
+    def stamp(self, frame, positions, offsets, color):
+        # Every position is at least a cell away from the frame's edge, so the sprites never need clipping
+        width = frame.shape[1]
+        pixels = (positions[:, 1] * width + positions[:, 0])[:, np.newaxis] + (offsets[0] * width + offsets[1])
+        frame.reshape(-1, 3)[pixels.ravel()] = color
+
+    def rasterize_sprites(self):
+        if self.background is None:
+            self.prepare_sprites()
+
+        grid = self.compression_simulator.grid
+        frame = self.background.copy()
+        layers = self.get_particle_layers()
+
+        # Links between neighboring particles go underneath the particles
+        occupied = np.zeros(np.array(grid.max) - grid.min + 1, dtype=bool)
+        for color, coordinates in layers:
+            occupied[coordinates[:, 0] - grid.min[0], coordinates[:, 1] - grid.min[1]] = True
+
+        offset = np.array(grid.min)
+        right = np.argwhere(occupied[:-1, :] & occupied[1:, :]) + offset
+        up = np.argwhere(occupied[:, :-1] & occupied[:, 1:]) + offset
+        self.stamp(frame, right * CIRCLE_DIST + self.center, self.edge_offsets, EDGE_COLOR)
+        self.stamp(frame, up * CIRCLE_DIST + self.center, self.edge_offsets[::-1], EDGE_COLOR)
 
+        for color, coordinates in layers:
+            self.stamp(frame, coordinates.dot(axial_to_pixel_mat.T) * CIRCLE_DIST + self.center,
+                       self.sprite_offsets, color)
+
+        return frame
+
+    def draw_border(self, draw):
         for key in xrange(len(self.compression_simulator.grid.extrema)):
             extremum = self.compression_simulator.grid.extrema[key]
             pos = self.get_position_from_axial(extremum)
@@ -90,6 +167,30 @@ class RasterPlotter(object):
             neighbor_pos = self.get_position_from_axial(neighbor_extremum)
             draw.line([tuple(pos), tuple(neighbor_pos)], (255, 0, 0), EDGE_WIDTH)
 
+    def draw_plot(self):
+        if self.closed:
+            raise ValueError("This plotter has been closed.")
+
+        if self.mode == HEATMAP:
+            return Image.fromarray(self.rasterize_heatmap())
+
+        if self.mode == SPRITES:
+            plt = Image.fromarray(self.rasterize_sprites())
+            draw = ImageDraw.Draw(plt)
+        else:
+            plt = Image.new('RGB', tuple(self.size), BACKGROUND_COLOR)
+            draw = ImageDraw.Draw(plt)
+            self.draw_shapes(draw)
+
+        self.draw_text(draw)
+
+        return plt
+
+    def draw_shapes(self, draw):
+        drawn_hexagons = {}
+
+        self.draw_border(draw)
+
         if True:
             # This part draws the particles & their links
             for particle in self.compression_simulator.grid.get_all_particles():
@@ -111,6 +212,7 @@ class RasterPlotter(object):
 
                 drawn_hexagons[particle] = True
 
+    def draw_text(self, draw):
         start = self.get_position_from_axial(self.compression_simulator.grid.max)
         start = np.array([self.size[0] - start[0], start[1]])
         shift = (np.array([0, self.size[1]]) * 1.1 / TEXT_FACTOR).astype(int)
@@ -124,7 +226,8 @@ class RasterPlotter(object):
 
         start = self.get_position_from_axial(self.compression_simulator.grid.min)
         start = np.array([self.size[0] - start[0], start[1]])
-        text = "Algorithm: %s" % type(self.compression_simulator).__name__
+        text = "Algorithm: %s" % getattr(self.compression_simulator, "algorithm_name",
+                                         type(self.compression_simulator).__name__)
         w, h = draw.textsize(text, self.font)
         draw.text(start - np.array([w, 0]), text, (0, 0, 0), self.font)
 
@@ -133,22 +236,19 @@ class RasterPlotter(object):
         w, h = draw.textsize(text, self.font)
         draw.text(start - np.array([w, 0]), text, (0, 0, 0), self.font)
 
-        return plt
-
     def plot(self, filename):
         plt = self.draw_plot()
-        self.gif_writer.append_data(np.array(plt))
+        if self.gif_writer is not None:
+            self.gif_writer.append(np.array(plt))
 
         # threading.Thread(target=save_plt, args=(plt, os.path.join(self.path, filename))).start()
         save_plt(plt, os.path.join(self.path, filename))
 
     def close(self):
-        plt = self.draw_plot()
-
-        for x in xrange(9):
-            self.gif_writer.append_data(np.array(plt))
+        if self.gif_writer is not None:
+            self.gif_writer.append(np.array(self.draw_plot()))
+            self.gif_writer.close(FINAL_FRAME_DURATION)
 
-        self.gif_writer.close()
         self.closed = True
 
         # imageio.mimsave(self.gif_path, [np.asarray(x) for x in self.gif_writer], duration=0.5)
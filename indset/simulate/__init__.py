@@ -1,3 +1,10 @@
 # coding=utf-8
 from grid import Particle, Grid, Directions
+from storage import ListMap, ArrayMap
+from statistics import StreamingStatistics
 from alignmentsimulator import AlignmentSimulator
+from rejectionfree import RejectionFreeSimulator
+from connectivity import IncrementalComponents, IncrementalHoles, label_components
+from trajectory import TrajectoryRecorder, TrajectoryReader
+from replicas import ReplicaSimulator
+from domains import DomainSimulator
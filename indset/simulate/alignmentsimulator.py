@@ -1,25 +1,45 @@
 # coding=utf-8
 import datetime
 import random
+import timeit
+
+import numpy as np
 
 from . import Directions
+from .energy import LocalEnergyTable, SHELL_SIZE
+from .instrumentation import MoveStatistics, BOUNDS, EXISTING, INVALID, PROBABILITY, OCCUPANCY, VALIDITY, MOVE, \
+    DRAW, SCAN, GENERIC, FLAT, BATCHED
+from .statistics import StreamingStatistics
+from .storage import ArrayMap, VisitTracker
 
 
 class AlignmentSimulator(object):
-    def __init__(self, grid, bias):
+    def __init__(self, grid, bias, seed=None, batch_size=None, probability_sink=None):
         self.validate_grid(grid)
 
         self.grid = grid
         self.bias = float(bias)
         self.start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+        # The sequential chain draws from random, the batched engine from the numpy random state
+        self.random = random.Random(seed)
+        self.random_state = np.random.RandomState(seed)
+        self.batch_size = batch_size
+
         self.rounds = 0
         self.movements = 0
-        self.visited = {}
+        self.round_trackers = {}
 
         self.iterations_run = 0
 
-        self.probability_series = []
+        # Every computed move probability goes here; the default sink only keeps running aggregates
+        self.probability_sink = StreamingStatistics() if probability_sink is None else probability_sink
+
+        # Opt-in TrajectoryRecorder that gets every accepted move
+        self.trajectory_recorder = None
+
+        # MoveStatistics, set by enable_instrumentation
+        self.instrumentation = None
 
     @staticmethod
     def validate_grid(grid):
@@ -27,18 +47,180 @@ class AlignmentSimulator(object):
             if grid.neighbor_count(particle.axial_coordinates) != 0:
                 raise ValueError("AlignmentSimulator conditions not met: particles cannot be adjacent.")
 
+    def get_engine(self):
+        # Array backed grids go through the flat index fast path, in blocks when a batch size is set
+        if self.grid.flat_map is None:
+            return GENERIC
+
+        return BATCHED if self.batch_size else FLAT
+
+    def enable_instrumentation(self, timing_sample_every=0):
+        # The statistics are tied to the engine runs use now, so that timings are never mixed across engines
+        self.instrumentation = MoveStatistics([self.bias], timing_sample_every, self.get_engine())
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
     def run_iterations(self, iterations, classes_to_move=None):
+        engine = self.get_engine()
+        if self.instrumentation is not None and self.instrumentation.engine != engine:
+            raise ValueError("Instrumentation was enabled for the %s engine, but this run would use the %s engine."
+                             % (self.instrumentation.engine, engine))
+
+        if engine == BATCHED:
+            return self.run_iterations_batched(iterations, classes_to_move)
+
         particles = list(self.grid.get_all_particles(classes_to_move))
         directions = Directions.ALL
 
+        if engine == GENERIC:
+            move = self.move if self.instrumentation is None else self.move_instrumented
+        else:
+            move = self.move_flat if self.instrumentation is None else self.move_flat_instrumented
+        rng = self.random
+
         moves_made = 0
         for n in xrange(iterations):
-            if self.move(random.choice(particles), random.choice(directions), random.random()):
+            if move(rng.choice(particles), rng.choice(directions), rng.random(), classes_to_move):
                 moves_made += 1
             self.iterations_run += 1
 
         return moves_made
 
+    def run_iterations_batched(self, iterations, classes_to_move=None):
+        # Proposals are drawn in blocks. Targets that are walls or occupied when the block is drawn are rejected in
+        # bulk: particles are never adjacent, so such a target can only open up once its own particle has moved
+        # earlier in the block. Those stale proposals, and the survivors, are then run in order.
+        # propose returns True for an accepted move and the rejection reason otherwise.
+        flat_map = self.grid.flat_map
+        cells = flat_map.cells
+        occupancy = flat_map.occupancy
+        empty = ArrayMap.EMPTY
+        first_degree = flat_map.first_degree
+        second_degree = flat_map.second_degree
+        probability_tables = {}
+        direction_offsets = flat_map.direction_offsets
+        offsets_array = np.array(direction_offsets)
+
+        particles = list(self.grid.get_all_particles(classes_to_move))
+        positions = [flat_map.flat_index(p.axial_coordinates) for p in particles]
+        record_probability = self.probability_sink.append
+
+        def propose(k, stale):
+            i = indices[k]
+            current_location = positions[i]
+
+            if stale:
+                new_location = current_location + direction_offsets[direction_numbers[k]]
+                if cells[new_location] != empty:
+                    return EXISTING if cells[new_location] >= 0 else BOUNDS
+            else:
+                new_location = targets[k]
+
+            if first_degree[new_location] > 1:
+                return INVALID
+
+            particle = particles[i]
+            bias = self.get_bias(particle)
+            probabilities = probability_tables.get(bias)
+            if probabilities is None:
+                probabilities = probability_tables[bias] = LocalEnergyTable.for_bias(bias).delta_probabilities
+
+            prob_move = probabilities[second_degree[new_location] - second_degree[current_location] + SHELL_SIZE]
+            record_probability(prob_move)
+
+            if not uniforms[k] < prob_move:
+                return PROBABILITY
+
+            flat_map.move_flat(current_location, new_location)
+            positions[i] = new_location
+            moved.add(i)
+
+            if self.trajectory_recorder is not None:
+                self.trajectory_recorder.record(self.iterations_run + k + 1, particle.id, direction_numbers[k])
+
+            return self.record_movement(particle, classes_to_move)
+
+        stats = self.instrumentation
+        if stats is not None:
+            # Proposals and bulk rejections are counted per block, proposals that are run one by one as they are run
+            particle_biases = [self.get_bias(p) for p in particles]
+            bias_members = dict((bias, np.array([i for i, b in enumerate(particle_biases) if b == bias], dtype=int))
+                                for bias in set(particle_biases))
+            timed = stats.timing_sample_every > 0
+            run_proposal = propose
+
+            def propose(k, stale):
+                if stale and not open_mask[k]:
+                    # Rerun after its particle moved, so it no longer counts as rejected in bulk
+                    stats.reject(BOUNDS if target_cells[k] == ArrayMap.WALL else EXISTING, -1)
+
+                outcome = run_proposal(k, stale)
+                if outcome is True:
+                    stats.accept(direction_numbers[k], particle_biases[indices[k]])
+                else:
+                    stats.reject(outcome)
+                return outcome
+
+        moves_made = 0
+        remaining = iterations
+        while remaining > 0:
+            block = min(remaining, self.batch_size)
+            if stats is not None and timed:
+                started = timeit.default_timer()
+
+            index_array = self.random_state.randint(len(particles), size=block)
+            direction_array = self.random_state.randint(len(direction_offsets), size=block)
+            uniforms = self.random_state.random_sample(block).tolist()
+
+            target_array = np.array(positions)[index_array] + offsets_array[direction_array]
+            target_cells = occupancy[target_array]
+            open_mask = target_cells == empty
+
+            indices = index_array.tolist()
+            direction_numbers = direction_array.tolist()
+            targets = target_array.tolist()
+
+            blocked = np.flatnonzero(~open_mask).tolist()
+            blocked.append(block)
+
+            if stats is not None:
+                particle_counts = np.bincount(index_array, minlength=len(particles))
+                stats.start_block(np.bincount(direction_array, minlength=len(direction_offsets)).tolist(),
+                                  [(bias, int(particle_counts[members].sum()))
+                                   for bias, members in bias_members.items()])
+                blocked_cells = target_cells[~open_mask]
+                walls = int(np.count_nonzero(blocked_cells == ArrayMap.WALL))
+                stats.reject(BOUNDS, walls)
+                stats.reject(EXISTING, len(blocked_cells) - walls)
+                if timed:
+                    drawn = timeit.default_timer()
+                    stats.time_block(DRAW, drawn - started, block)
+
+            moved = set()
+            b = 0
+            for k in np.flatnonzero(open_mask).tolist():
+                while blocked[b] < k:
+                    if indices[blocked[b]] in moved and propose(blocked[b], True) is True:
+                        moves_made += 1
+                    b += 1
+                if propose(k, indices[k] in moved) is True:
+                    moves_made += 1
+
+            while blocked[b] < block:
+                if indices[blocked[b]] in moved and propose(blocked[b], True) is True:
+                    moves_made += 1
+                b += 1
+
+            if stats is not None and timed:
+                stats.time_block(SCAN, timeit.default_timer() - drawn, block)
+
+            self.iterations_run += block
+            remaining -= block
+
+        return moves_made
+
     def get_bias(self, particle):
         return self.bias
 
@@ -46,7 +228,7 @@ class AlignmentSimulator(object):
         current_neighbors = self.grid.second_degree_neighbor_count(current_location)
         new_neighbors = self.grid.second_degree_neighbor_count(new_location)
 
-        return self.get_bias(particle) ** (new_neighbors - current_neighbors)
+        return LocalEnergyTable.for_bias(self.get_bias(particle)).delta_probability(new_neighbors - current_neighbors)
 
     def move(self, random_particle, random_direction, probability, classes_to_move=None):
         # Check if new location is empty
@@ -55,44 +237,167 @@ class AlignmentSimulator(object):
 
         if not self.grid.is_position_in_bounds(new_location):
             # New location out of board bounds
-            # print("Bounds")
             return False
 
         if self.grid.get_particle(new_location) is not None:
             # There already is a particle at this new position
-            # print("Existing", current_location, random_direction, new_location)
             return False
 
         if not self.valid_move(random_particle, current_location, new_location,
                                random_direction):  # TODO: Check classes to move?
-            # print("Invalid")
             return False
 
         prob_move = self.get_move_probability(random_particle, current_location, new_location)
-        # print("Prob: " + str(prob_move))
-        self.probability_series.append(prob_move)
+        self.probability_sink.append(prob_move)
 
         if not probability < prob_move:  # Choose with probability
-            # print probability
             return False
 
         self.grid.move_particle(current_location, new_location)
 
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self.iterations_run + 1, random_particle.id, random_direction.number)
+
+        return self.record_movement(random_particle, classes_to_move)
+
+    def move_instrumented(self, random_particle, random_direction, probability, classes_to_move=None):
+        # Same as move, but counting every outcome and timing the phases of sampled proposals
+        stats = self.instrumentation
+        bias = self.get_bias(random_particle)
+        timer = stats.start(random_direction.number, bias)
+
+        current_location = random_particle.axial_coordinates
+        new_location = self.grid.get_position_in_direction(current_location, random_direction)
+
+        in_bounds = self.grid.is_position_in_bounds(new_location)
+        timer.lap(BOUNDS)
+        if not in_bounds:
+            stats.reject(BOUNDS)
+            return False
+
+        existing = self.grid.get_particle(new_location)
+        timer.lap(OCCUPANCY)
+        if existing is not None:
+            stats.reject(EXISTING)
+            return False
+
+        valid = self.valid_move(random_particle, current_location, new_location, random_direction)
+        timer.lap(VALIDITY)
+        if not valid:
+            stats.reject(INVALID)
+            return False
+
+        prob_move = self.get_move_probability(random_particle, current_location, new_location)
+        self.probability_sink.append(prob_move)
+        timer.lap(PROBABILITY)
+        if not probability < prob_move:
+            stats.reject(PROBABILITY)
+            return False
+
+        self.grid.move_particle(current_location, new_location)
+
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self.iterations_run + 1, random_particle.id, random_direction.number)
+
+        moved = self.record_movement(random_particle, classes_to_move)
+        timer.lap(MOVE)
+        stats.accept(random_direction.number, bias)
+
+        return moved
+
+    def move_flat_instrumented(self, random_particle, random_direction, probability, classes_to_move=None):
+        # Same as move_flat, but counting every outcome and timing the phases of sampled proposals
+        stats = self.instrumentation
+        bias = self.get_bias(random_particle)
+        timer = stats.start(random_direction.number, bias)
+
+        flat_map = self.grid.flat_map
+        cells = flat_map.cells
+
+        current_location = flat_map.flat_index(random_particle.axial_coordinates)
+        new_location = current_location + flat_map.direction_offsets[random_direction.number]
+
+        target = cells[new_location]
+        timer.lap(OCCUPANCY)
+        if target != ArrayMap.EMPTY:
+            stats.reject(BOUNDS if target == ArrayMap.WALL else EXISTING)
+            return False
+
+        valid = flat_map.first_degree[new_location] <= 1
+        timer.lap(VALIDITY)
+        if not valid:
+            stats.reject(INVALID)
+            return False
+
+        delta = flat_map.second_degree[new_location] - flat_map.second_degree[current_location]
+        prob_move = LocalEnergyTable.for_bias(bias).delta_probability(delta)
+        self.probability_sink.append(prob_move)
+        timer.lap(PROBABILITY)
+        if not probability < prob_move:
+            stats.reject(PROBABILITY)
+            return False
+
+        flat_map.move_flat(current_location, new_location)
+
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self.iterations_run + 1, random_particle.id, random_direction.number)
+
+        moved = self.record_movement(random_particle, classes_to_move)
+        timer.lap(MOVE)
+        stats.accept(random_direction.number, bias)
+
+        return moved
+
+    def move_flat(self, random_particle, random_direction, probability, classes_to_move=None):
+        # Same proposal as move, but working directly on the occupancy array of an ArrayMap backed grid
+        flat_map = self.grid.flat_map
+        cells = flat_map.cells
+
+        current_location = flat_map.flat_index(random_particle.axial_coordinates)
+        new_location = current_location + flat_map.direction_offsets[random_direction.number]
+
+        if cells[new_location] != ArrayMap.EMPTY:
+            # Out of bounds, or there already is a particle at this new position
+            return False
+
+        if flat_map.first_degree[new_location] > 1:
+            return False
+
+        delta = flat_map.second_degree[new_location] - flat_map.second_degree[current_location]
+        prob_move = LocalEnergyTable.for_bias(self.get_bias(random_particle)).delta_probability(delta)
+        self.probability_sink.append(prob_move)
+
+        if not probability < prob_move:
+            return False
+
+        flat_map.move_flat(current_location, new_location)
+
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(self.iterations_run + 1, random_particle.id, random_direction.number)
+
+        return self.record_movement(random_particle, classes_to_move)
+
+    def record_movement(self, random_particle, classes_to_move=None):
         # Movement counting
         self.movements += 1
 
         # Round checking
-        self.visited[random_particle] = True
-        for particle in self.grid.get_all_particles(classes_to_move):
-            if not self.visited.get(particle, False):
-                return True
-
-        # If this point is reached, a round has completed
-        self.rounds += 1
-        self.visited = {}
+        if self.get_round_tracker(classes_to_move).visit(random_particle.id):
+            self.rounds += 1
 
         return True
 
+    def get_round_tracker(self, classes_to_move=None):
+        # Trackers are rebuilt, starting a fresh round, once particles have been added to or removed from the grid
+        version = self.grid.particle_set_version
+        cached = self.round_trackers.get(classes_to_move)
+
+        if cached is None or cached[0] != version:
+            cached = (version, VisitTracker(p.id for p in self.grid.get_all_particles(classes_to_move)))
+            self.round_trackers[classes_to_move] = cached
+
+        return cached[1]
+
     def valid_move(self, particle, old_position, new_position, direction):
         # Check if the new position has any existing neighbors other than this one
         nbr_cnt = self.grid.neighbor_count(new_position)
@@ -105,13 +410,22 @@ class AlignmentSimulator(object):
 
         return True
 
-    def get_metrics(self, classes_to_move=None):
-        metrics = [("Bias", "%.2f", self.bias),
-                   ("Iterations", "%d", self.iterations_run),
-                   ("Movements made", "%d", self.movements),
-                   ("Rounds completed:", "%d", self.rounds),
-                   #("Perimeter", "%d", self.grid.calculate_perimeter(classes_to_move)),
-                   #("Center of mass", "x = %.2f, y = %.2f", tuple(self.grid.find_center_of_mass(classes_to_move)))
+    def get_metric_definitions(self, classes_to_move=None):
+        # (name, format, function) for every metric, so that callers can compute only the ones they need
+        metrics = [("Bias", "%.2f", lambda: self.bias),
+                   ("Iterations", "%d", lambda: self.iterations_run),
+                   ("Movements made", "%d", lambda: self.movements),
+                   ("Rounds completed:", "%d", lambda: self.rounds),
+                   ("Second degree neighborhoods", "%d", self.grid.count_second_degree_neighborhoods),
+                   ("Hole components", "%d", self.grid.count_hole_components),
+                   #("Perimeter", "%d", lambda: self.grid.calculate_perimeter(classes_to_move)),
+                   #("Center of mass", "x = %.2f, y = %.2f", lambda: tuple(self.grid.find_center_of_mass(classes_to_move)))
         ]
 
+        if self.instrumentation is not None:
+            metrics += self.instrumentation.get_metric_definitions()
+
         return metrics
+
+    def get_metrics(self, classes_to_move=None):
+        return [(name, fmt, function()) for name, fmt, function in self.get_metric_definitions(classes_to_move)]
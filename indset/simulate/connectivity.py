@@ -0,0 +1,284 @@
+# coding=utf-8
+import array
+from collections import deque
+
+import numpy as np
+
+
+def label_components(mask):
+    """Labels the 4-connected components of a 2d boolean mask.
+
+    Returns the number of components and an int array holding each cell's component in 0..count - 1, or -1 for
+    cells outside the mask. Uses a vectorised union-find: every round hooks the larger of two touching roots onto
+    the smaller one and then compresses all paths by pointer jumping.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    cells = np.arange(mask.size).reshape(mask.shape)
+
+    vertical = mask[:-1, :] & mask[1:, :]
+    horizontal = mask[:, :-1] & mask[:, 1:]
+    a = np.concatenate([cells[:-1, :][vertical], cells[:, :-1][horizontal]])
+    b = np.concatenate([cells[1:, :][vertical], cells[:, 1:][horizontal]])
+
+    parent = np.arange(mask.size)
+    while True:
+        root_a = parent[a]
+        root_b = parent[b]
+        differing = root_a != root_b
+        if not differing.any():
+            break
+
+        # Roots only ever point at smaller roots, so no cycles can form whichever hook wins
+        low = np.minimum(root_a, root_b)[differing]
+        high = np.maximum(root_a, root_b)[differing]
+        parent[high] = low
+
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+    labels = np.full(mask.shape, -1, dtype=np.int64)
+    roots = parent.reshape(mask.shape)[mask]
+    if roots.size == 0:
+        return 0, labels
+
+    unique_roots, inverse = np.unique(roots, return_inverse=True)
+    labels[mask] = inverse
+    return len(unique_roots), labels
+
+
+def count_components(mask):
+    return label_components(mask)[0]
+
+
+def bfs_connected(start, position_include_fn, neighbor_positions_fn):
+    visited = {start}
+    queue = deque([start])
+    while queue:
+        vertex = queue.popleft()
+        for neighbor in neighbor_positions_fn(vertex):
+            if neighbor not in visited and position_include_fn(neighbor):
+                visited.add(neighbor)
+                queue.append(neighbor)
+
+    return visited
+
+
+def _separate_pieces(members, starts, offsets):
+    # members lost a cell whose remaining neighbors are starts. Runs one breadth-first search per start, a step at a
+    # time each, merging searches that meet. A group of searches that runs out of cells has found a whole piece that
+    # split off; once a single group is left, the rest stays together. Returns the pieces that split off, so the
+    # work is bounded by their size rather than by the size of the whole component.
+    owner = {}
+    group = range(len(starts))
+    queues = []
+    for i, start in enumerate(starts):
+        owner[start] = i
+        queues.append(deque([start]))
+
+    def find(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+
+    pieces = []
+    active = set(xrange(len(starts)))
+    while len(active) > 1:
+        for i in xrange(len(starts)):
+            queue = queues[i]
+            if not queue:
+                continue
+
+            vertex = queue.popleft()
+            for offset in offsets:
+                neighbor = vertex + offset
+                if neighbor not in members:
+                    continue
+
+                j = owner.get(neighbor)
+                if j is None:
+                    owner[neighbor] = i
+                    queue.append(neighbor)
+                elif find(i) != find(j):
+                    root_i, root_j = find(i), find(j)
+                    group[max(root_i, root_j)] = min(root_i, root_j)
+                    active.discard(max(root_i, root_j))
+
+        for root in list(active):
+            if len(active) > 1 and not any(queues[i] for i in xrange(len(starts)) if find(i) == root):
+                active.discard(root)
+                pieces.append(set(v for v, i in owner.iteritems() if find(i) == root))
+
+    return pieces
+
+
+class IncrementalComponents(object):
+    """Keeps the connected components of the particles on an ArrayMap up to date as particles are added, removed
+    and moved.
+
+    Cells are connected through offsets, the four neighbors by default; fixed cells, such as walls, are members that
+    never move. Adding a particle merges the components around it, relabelling the smaller ones. Removing one
+    searches outwards from its neighbors until they meet again, so a change only costs as much as the pieces it
+    splits off.
+    """
+
+    def __init__(self, flat_map, offsets=None, fixed=()):
+        self.flat_map = flat_map
+        self.offsets = list(flat_map.neighbor_offsets if offsets is None else offsets)
+
+        self._labels = array.array('i', [-1]) * len(flat_map.cells)
+        self._components = {}
+        self._next_label = 0
+
+        for flat in list(fixed) + np.flatnonzero(flat_map.occupancy >= 0).tolist():
+            self.particle_added(flat)
+
+        flat_map.add_observer(self)
+
+    @property
+    def count(self):
+        return len(self._components)
+
+    def component_sizes(self):
+        return sorted((len(c) for c in self._components.itervalues()), reverse=True)
+
+    def _new_component(self, members):
+        label = self._next_label
+        self._next_label += 1
+
+        self._components[label] = members
+        for flat in members:
+            self._labels[flat] = label
+
+    def particle_added(self, flat):
+        labels = set(self._labels[flat + offset] for offset in self.offsets)
+        labels.discard(-1)
+
+        if not labels:
+            self._new_component({flat})
+            return
+
+        # Merge everything into the largest neighboring component
+        largest = max(labels, key=lambda l: len(self._components[l]))
+        members = self._components[largest]
+        for label in labels:
+            if label != largest:
+                for other in self._components.pop(label):
+                    self._labels[other] = largest
+                    members.add(other)
+
+        members.add(flat)
+        self._labels[flat] = largest
+
+    def particle_removed(self, flat):
+        label = self._labels[flat]
+        members = self._components[label]
+        members.discard(flat)
+        self._labels[flat] = -1
+
+        if not members:
+            del self._components[label]
+            return
+
+        starts = [flat + offset for offset in self.offsets if self._labels[flat + offset] == label]
+        if len(starts) < 2:
+            return
+
+        for piece in _separate_pieces(members, starts, self.offsets):
+            members -= piece
+            self._new_component(piece)
+
+    def particle_moved(self, old_flat, new_flat):
+        self.particle_removed(old_flat)
+        self.particle_added(new_flat)
+
+
+def _quad_weights():
+    # Contribution of a 2x2 window to 4 * (components - holes) of a 4-connected set, by the window's bit pattern:
+    # bit 0 is the top left cell, then top right, bottom left and bottom right
+    weights = []
+    for pattern in xrange(16):
+        count = bin(pattern).count("1")
+        if count == 1:
+            weights.append(1)
+        elif count == 3:
+            weights.append(-1)
+        elif pattern in (0b1001, 0b0110):
+            weights.append(2)
+        else:
+            weights.append(0)
+
+    return weights
+
+
+class IncrementalHoles(object):
+    """Keeps the number of 4-connected components of the empty in-bounds cells of an ArrayMap up to date.
+
+    For a 4-connected set, components minus holes is the Euler number, (Q1 - Q3 + 2 * QD) / 4, where Q1, Q3 and QD
+    count the 2x2 windows holding one, three or two diagonal cells of the set. A particle moving changes only the
+    windows around its two cells, so the sum is updated in constant time. The holes of the empty cells are the
+    8-connected groups of particles that do not touch the walls, which an IncrementalComponents over the particles
+    and the innermost ring of walls counts: the walls form one group, every other group is a hole.
+    """
+    QUAD_WEIGHTS = _quad_weights()
+
+    def __init__(self, flat_map):
+        self.flat_map = flat_map
+        self.stride = flat_map.stride
+
+        empty = flat_map.grid_view() == flat_map.EMPTY
+        patterns = (empty[:-1, :-1].astype(np.int64) | empty[:-1, 1:] << 1 | empty[1:, :-1] << 2 |
+                    empty[1:, 1:] << 3)
+        self._quad_sum = int(np.take(self.QUAD_WEIGHTS, patterns).sum())
+
+        # Walls next to, or diagonal to, an in-bounds cell
+        padded = np.pad(flat_map.grid_view() != flat_map.WALL, 1, mode="constant")
+        near_bounds = np.zeros(flat_map.shape, dtype=bool)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                near_bounds |= padded[dx:dx + flat_map.shape[0], dy:dy + flat_map.shape[1]]
+        inner_walls = np.flatnonzero((flat_map.grid_view() == flat_map.WALL) & near_bounds).tolist()
+
+        s = self.stride
+        self.obstacles = IncrementalComponents(flat_map, flat_map.neighbor_offsets + [s + 1, s - 1, -s + 1, -s - 1],
+                                               fixed=inner_walls)
+
+        flat_map.add_observer(self)
+
+    @property
+    def count(self):
+        return self._quad_sum / 4 + self.obstacles.count - 1
+
+    def _changed(self, flats):
+        # flats have just switched between empty and occupied; re-weigh every window around them
+        cells = self.flat_map.cells
+        empty = self.flat_map.EMPTY
+        s = self.stride
+        weights = self.QUAD_WEIGHTS
+
+        corners = set()
+        for flat in flats:
+            corners.update((flat, flat - 1, flat - s, flat - s - 1))
+
+        for corner in corners:
+            window = (corner, corner + 1, corner + s, corner + s + 1)
+            after = ((cells[window[0]] == empty) | (cells[window[1]] == empty) << 1 |
+                     (cells[window[2]] == empty) << 2 | (cells[window[3]] == empty) << 3)
+            before = after
+            for bit, cell in enumerate(window):
+                if cell in flats:
+                    before ^= 1 << bit
+
+            self._quad_sum += weights[after] - weights[before]
+
+    def particle_added(self, flat):
+        self._changed((flat,))
+
+    def particle_removed(self, flat):
+        self._changed((flat,))
+
+    def particle_moved(self, old_flat, new_flat):
+        self._changed((old_flat, new_flat))
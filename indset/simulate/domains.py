@@ -0,0 +1,218 @@
+# coding=utf-8
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from .energy import LocalEnergyTable, SHELL_SIZE
+from .layout import FlatLayout
+from .storage import ArrayMap
+from .workers import WorkerPool
+
+# A move writes counts up to two cells away from its old and new cells, so two tiles of the same color, a whole tile
+# apart, can only stay out of each other's way if that tile is at least this wide
+MIN_TILE_SIZE = 4
+
+COLORS = 4
+
+# Columns of the shared tile table
+TILE_START, TILE_COUNT, TILE_X_LOW, TILE_X_HIGH, TILE_Y_LOW, TILE_Y_HIGH = range(6)
+
+
+def _run_tiles(shared, first, last, random_state, probabilities):
+    # One phase of one worker: every tile in rows first to last of the tile table gets as many proposals as it holds
+    # particles. Only moves that stay inside the tile are allowed, so the particles of a tile are fixed for the phase.
+    cells, first_degree, second_degree, positions, order, tiles, stride = shared
+    empty = ArrayMap.EMPTY
+    direction_offsets = [stride, 1, -stride, -1]
+    neighbor_offsets = direction_offsets
+    shell_offsets = [2 * stride, -2 * stride, 2, -2, stride + 1, stride - 1, -stride + 1, -stride - 1]
+
+    table = np.frombuffer(tiles, dtype=np.dtype('l')).reshape(-1, 6)[first:last].tolist()
+    total = sum(row[TILE_COUNT] for row in table)
+    picks = random_state.random_sample(total).tolist()
+    directions = random_state.randint(len(direction_offsets), size=total).tolist()
+    uniforms = random_state.random_sample(total).tolist()
+
+    moves_made = 0
+    pairs_change = 0
+    base = 0
+    for start, count, x_low, x_high, y_low, y_high in table:
+        for k in xrange(base, base + count):
+            i = order[start + int(picks[k] * count)]
+            current = positions[i]
+            new = current + direction_offsets[directions[k]]
+
+            x, y = divmod(new, stride)
+            if x < x_low or x >= x_high or y < y_low or y >= y_high:
+                continue
+            if cells[new] != empty or first_degree[new] > 1:
+                continue
+
+            delta = second_degree[new] - second_degree[current]
+            if not uniforms[k] < probabilities[delta + SHELL_SIZE]:
+                continue
+
+            # The same bookkeeping as ArrayMap.move_flat
+            pairs_change -= second_degree[current]
+            cells[new] = cells[current]
+            cells[current] = empty
+            for offset in neighbor_offsets:
+                first_degree[current + offset] -= 1
+                first_degree[new + offset] += 1
+            for offset in shell_offsets:
+                second_degree[current + offset] -= 1
+                second_degree[new + offset] += 1
+            pairs_change += second_degree[new]
+
+            positions[i] = new
+            moves_made += 1
+        base += count
+
+    return moves_made, pairs_change, total
+
+
+def _start_domain_worker(shared, seed, probabilities):
+    random_state = np.random.RandomState(seed)
+    state = {"probabilities": probabilities}
+
+    def run_phase(tile_rows):
+        return _run_tiles(shared, tile_rows[0], tile_rows[1], random_state, state["probabilities"])
+
+    def set_probabilities(new_probabilities):
+        state["probabilities"] = new_probabilities
+
+    return {"phase": run_phase, "bias": set_probabilities}
+
+
+class DomainSimulator(object):
+    """Runs one AlignmentSimulator chain over a large grid on several worker processes.
+
+    The ArrayMap cells, first and second degree counts and particle positions live in shared memory. Every sweep lays
+    a grid of tile_size wide square tiles over the lattice at a random offset and colors the tiles like a checkerboard
+    with four colors, so that tiles of the same color are a whole tile apart. The sweep then runs one phase per color:
+    the tiles of that color are split among the workers, and every tile gets as many proposals as it holds particles,
+    with moves out of the tile rejected. Tiles of the same color never read or write the same cells, so they run
+    concurrently, and the workers are synchronized after every phase.
+
+    Proposals within a tile are symmetric and accepted with the AlignmentSimulator probabilities, so every phase keeps
+    detailed balance; the random offsets let particles cross tile borders from one sweep to the next. Tiles much
+    smaller than the clusters that form at high biases slow mixing down.
+
+    Move probabilities and rounds are not recorded, so the metrics leave rounds out.
+    """
+
+    def __init__(self, grid, bias, processes=None, tile_size=16, seed=None):
+        if tile_size < MIN_TILE_SIZE:
+            raise ValueError("Tiles need to be at least %d cells wide." % MIN_TILE_SIZE)
+
+        self.size = grid.size
+        self.bias = float(bias)
+        self.tile_size = tile_size
+        self.processes = processes or multiprocessing.cpu_count()
+        self.random_state = np.random.RandomState(seed)
+
+        self.layout = FlatLayout(grid)
+        self.particles = self.layout.particles
+        flat_map = self.layout.map
+
+        self.cells = RawArray('i', self.layout.cells.tolist())
+        self.first_degree = RawArray('i', flat_map.first_degree.tolist())
+        self.second_degree = RawArray('i', flat_map.second_degree.tolist())
+        self.positions = RawArray('l', self.layout.start.tolist())
+        self.order = RawArray('l', len(self.particles))
+
+        # One row per tile, at most one more tile per axis than fits without an offset
+        tiles_x = flat_map.shape[0] // tile_size + 2
+        tiles_y = flat_map.shape[1] // tile_size + 2
+        self.tiles = RawArray('l', tiles_x * tiles_y * 6)
+
+        self.second_degree_pairs = flat_map.second_degree_pairs
+        self.movements = 0
+        self.iterations_run = 0
+        self.sweeps_run = 0
+
+        shared = (self.cells, self.first_degree, self.second_degree, self.positions, self.order, self.tiles,
+                  flat_map.stride)
+        probabilities = LocalEnergyTable.for_bias(self.bias).delta_probabilities
+        seeds = self.random_state.randint(2 ** 31 - 1, size=self.processes).tolist()
+
+        # Workers are forked after the shared arrays exist, so they inherit them
+        self.workers = WorkerPool(_start_domain_worker, [(shared, worker_seed, probabilities) for worker_seed in seeds])
+
+    def set_bias(self, bias):
+        self.bias = float(bias)
+        probabilities = LocalEnergyTable.for_bias(self.bias).delta_probabilities
+        self.workers.request_all([(w, "bias", probabilities) for w in xrange(len(self.workers))])
+
+    def layout_tiles(self):
+        # Sorts the particles by tile for a new random offset and fills the tile table, grouped by color. Returns the
+        # table rows at which every color starts, plus the end of the last one.
+        tile_size = self.tile_size
+        stride = self.layout.map.stride
+        offset_x, offset_y = self.random_state.randint(tile_size, size=2)
+        tiles_y = self.layout.map.shape[1] // tile_size + 2
+
+        positions = np.frombuffer(self.positions, dtype=np.dtype('l'))
+        x, y = positions // stride, positions % stride
+        tile_ids = (x + offset_x) // tile_size * tiles_y + (y + offset_y) // tile_size
+
+        order = np.argsort(tile_ids, kind="mergesort")
+        np.frombuffer(self.order, dtype=np.dtype('l'))[:] = order
+
+        ids, starts, counts = np.unique(tile_ids[order], return_index=True, return_counts=True)
+        tile_x, tile_y = ids // tiles_y, ids % tiles_y
+        colors = tile_x % 2 * 2 + tile_y % 2
+
+        by_color = np.argsort(colors, kind="mergesort")
+        rows = np.frombuffer(self.tiles, dtype=np.dtype('l')).reshape(-1, 6)
+        table = rows[:len(ids)]
+        table[:, TILE_START] = starts[by_color]
+        table[:, TILE_COUNT] = counts[by_color]
+        table[:, TILE_X_LOW] = tile_x[by_color] * tile_size - offset_x
+        table[:, TILE_X_HIGH] = table[:, TILE_X_LOW] + tile_size
+        table[:, TILE_Y_LOW] = tile_y[by_color] * tile_size - offset_y
+        table[:, TILE_Y_HIGH] = table[:, TILE_Y_LOW] + tile_size
+
+        return np.searchsorted(colors[by_color], np.arange(COLORS + 1)), table[:, TILE_COUNT]
+
+    def run_sweeps(self, sweeps):
+        # A sweep makes one proposal per particle
+        moves_made = 0
+        for _ in xrange(sweeps):
+            color_starts, counts = self.layout_tiles()
+            cumulative = np.concatenate([[0], np.cumsum(counts)])
+
+            for color in xrange(COLORS):
+                first, last = color_starts[color], color_starts[color + 1]
+
+                # Split the color's tiles into contiguous runs holding about the same number of particles
+                targets = np.linspace(cumulative[first], cumulative[last], len(self.workers) + 1)
+                bounds = np.searchsorted(cumulative[first:last + 1], targets) + first
+                bounds[0], bounds[-1] = first, last
+
+                requests = [(w, "phase", (int(bounds[w]), int(bounds[w + 1])))
+                            for w in xrange(len(self.workers)) if bounds[w] < bounds[w + 1]]
+                for moves, pairs_change, proposals in self.workers.request_all(requests):
+                    moves_made += moves
+                    self.second_degree_pairs += pairs_change
+                    self.iterations_run += proposals
+
+            self.sweeps_run += 1
+
+        self.movements += moves_made
+        return moves_made
+
+    def get_grid(self):
+        return self.layout.build_grid(self.positions[:])
+
+    def get_simulator(self):
+        # A standalone AlignmentSimulator holding the current grid and counters. Rounds are not tracked, so its
+        # rounds stay at 0.
+        return self.layout.build_simulator(self.positions[:], self.bias, self.iterations_run, self.movements)
+
+    def get_metrics(self):
+        return [metric for metric in self.get_simulator().get_metrics() if metric[0] != "Rounds completed:"]
+
+    def close(self):
+        self.workers.close()
@@ -0,0 +1,30 @@
+# coding=utf-8
+SHELL_SIZE = 8
+
+
+class LocalEnergyTable(object):
+    """Maps the energy change of a move straight to its acceptance probability.
+
+    The energy change is the second degree neighbor count of the new site minus that of the old one, so it lies
+    between -SHELL_SIZE and SHELL_SIZE; delta_probabilities holds bias ** delta for each, indexed by delta + SHELL_SIZE.
+    """
+    _tables = {}
+
+    def __init__(self, bias):
+        self.bias = float(bias)
+
+        # Kept as a list since single Python-level lookups into it are much faster than into a numpy array
+        self.delta_probabilities = [self.bias ** delta for delta in xrange(-SHELL_SIZE, SHELL_SIZE + 1)]
+
+    @classmethod
+    def for_bias(cls, bias):
+        table = cls._tables.get(bias)
+
+        if table is None:
+            table = cls(bias)
+            cls._tables[bias] = table
+
+        return table
+
+    def delta_probability(self, delta):
+        return self.delta_probabilities[delta + SHELL_SIZE]
@@ -1,7 +1,10 @@
 # coding=utf-8
 import itertools
 
-from .storage import ListMap, ClassBasedList
+import numpy as np
+
+from .connectivity import bfs_connected, count_components, IncrementalHoles
+from .storage import ListMap, ArrayMap, ClassBasedList
 
 
 class Particle(object):
@@ -11,6 +14,22 @@ class Particle(object):
         self.axial_coordinates = tuple(int(x) for x in axial_coordinates)
         self.id = identifier
 
+    @classmethod
+    def create_many(cls, coordinates, identifiers):
+        # coordinates are (x, y) tuples of ints. Skips the per-particle __init__ call unless a subclass overrides it.
+        if cls.__init__ != Particle.__init__:
+            return [cls(position, identifier) for position, identifier in itertools.izip(coordinates, identifiers)]
+
+        new = object.__new__
+        particles = []
+        for position, identifier in itertools.izip(coordinates, identifiers):
+            particle = new(cls)
+            particle.axial_coordinates = position
+            particle.id = identifier
+            particles.append(particle)
+
+        return particles
+
     def get_color(self):
         return Particle.COLOR
 
@@ -40,7 +59,7 @@ class Directions(object):
 
 
 class Grid(object):
-    def __init__(self, size):
+    def __init__(self, size, map_backend=ListMap):
         self.size = tuple(size)
         self.width = size[0]
         self.height = size[1]
@@ -51,10 +70,21 @@ class Grid(object):
         self.extrema = [self.min, (self.min[0], self.max[1]), self.max,
                         (self.max[0], self.min[1])]
 
-        self._map_backend = ListMap(size)
+        self._map_backend = map_backend(size)
 
         self._particle_list = ClassBasedList()
 
+        # Bumped whenever particles are added or removed, so that caches of the particle set can tell they are stale
+        self.particle_set_version = 0
+
+        # IncrementalHoles, set by track_holes
+        self.hole_tracker = None
+
+    @property
+    def flat_map(self):
+        # Only array backed grids support the flat index API
+        return self._map_backend if isinstance(self._map_backend, ArrayMap) else None
+
     @staticmethod
     def is_position_between_positions(p, min_pos, max_pos):
         return not (p[0] <= min_pos[0] or p[1] <= min_pos[1] or p[0] >= max_pos[0] or p[1] >= max_pos[1])
@@ -82,6 +112,41 @@ class Grid(object):
 
         self._map_backend[particle.axial_coordinates] = particle
         self._particle_list.add(particle)
+        self.particle_set_version += 1
+
+    def add_particles(self, particles, coordinates=None):
+        # Adds many particles at once; array backed grids fill their cells and counts in bulk. coordinates, an (n, 2)
+        # array of the particles' positions, saves collecting them from the particles.
+        particles = list(particles)
+
+        if self.flat_map is None:
+            for particle in particles:
+                self.add_particle(particle)
+            return
+
+        if not all(issubclass(klass, Particle) for klass in set(type(p) for p in particles)):
+            raise ValueError("Grid only supports subclasses of Particle")
+
+        if coordinates is None:
+            coordinates = [p.axial_coordinates for p in particles]
+        coordinates = np.asarray(coordinates, dtype=np.int64).reshape(-1, 2)
+
+        if len(coordinates) and (np.any(coordinates <= self.min) or np.any(coordinates >= self.max)):
+            raise ValueError("Coordinates out of bounds")
+
+        flat_map = self.flat_map
+        flats = (coordinates[:, 0] + flat_map.PADDING - flat_map.min[0]) * flat_map.stride + \
+            coordinates[:, 1] + flat_map.PADDING - flat_map.min[1]
+
+        self._particle_list.extend(particles)
+        try:
+            flat_map.add_particles(flats, particles)
+        except ValueError:
+            for particle in particles:
+                self._particle_list.remove(particle)
+            raise
+
+        self.particle_set_version += 1
 
     def move_particle(self, old_position, new_position):
         particle = self.get_particle(old_position)
@@ -103,6 +168,7 @@ class Grid(object):
     def remove_particle(self, particle):
         del self._map_backend[particle.axial_coordinates]
         self._particle_list.remove(particle)
+        self.particle_set_version += 1
 
     def get_particle(self, axial_coordinates, classes_to_consider=None):
         particle = self._map_backend[axial_coordinates]
@@ -132,33 +198,70 @@ class Grid(object):
         return particles
 
     def particles_connected(self, classes_to_consider=None):
-        def has_eligible_particle(position):
-            return (self.is_position_in_bounds(position)) and (
-                self.get_particle(position, classes_to_consider) is not None)
-
-        return self.check_connected(has_eligible_particle)
+        return self.count_particle_components(classes_to_consider) <= 1
 
     def particle_holes(self, classes_to_consider=None):
-        def is_empty(position):
-            return (self.is_position_in_bounds(position)) and (
-                self.get_particle(position, classes_to_consider) is None)
+        return self.count_hole_components(classes_to_consider) <= 1
 
-        return self.check_connected(is_empty)
+    def _masks(self, classes_to_consider=None):
+        # Boolean arrays of the cells holding particles of the given classes and of the in-bounds cells: the flat
+        # map's own layout for array backed grids, one cell per position from min to max otherwise
+        flat_map = self.flat_map
 
-    def check_connected(self, position_include_fn):
-        def bfs(start):
-            visited, queue = set(), [start]
-            while queue:
-                vertex = queue.pop(0)
-                if vertex not in visited:
-                    visited.add(vertex)
+        if flat_map is not None:
+            in_bounds = flat_map.grid_view() != ArrayMap.WALL
+            if classes_to_consider is None:
+                return flat_map.grid_view() >= 0, in_bounds
+
+            shape = flat_map.shape
+            positions = [flat_map.flat_index(p.axial_coordinates) for p in self.get_all_particles(classes_to_consider)]
+        else:
+            shape = (self.max[0] - self.min[0] + 1, self.max[1] - self.min[1] + 1)
+            in_bounds = np.zeros(shape, dtype=bool)
+            in_bounds[1:-1, 1:-1] = True
+            positions = [(x - self.min[0]) * shape[1] + y - self.min[1]
+                         for x, y in (p.axial_coordinates for p in self.get_all_particles(classes_to_consider))]
+
+        mask = np.zeros(shape, dtype=bool).ravel()
+        mask[np.array(positions, dtype=np.int64)] = True
+        return mask.reshape(shape), in_bounds
+
+    def count_particle_components(self, classes_to_consider=None):
+        return count_components(self._masks(classes_to_consider)[0])
+
+    def count_hole_components(self, classes_to_consider=None):
+        if classes_to_consider is None and self.hole_tracker is not None:
+            return self.hole_tracker.count
+
+        particles, in_bounds = self._masks(classes_to_consider)
+        return count_components(in_bounds & ~particles)
+
+    def track_holes(self):
+        # Keeps the hole count up to date on every move from now on, so count_hole_components costs nothing. That
+        # only pays off when holes are counted far more often than every few thousand accepted moves.
+        if self.flat_map is None:
+            raise ValueError("Only array backed grids can track holes incrementally")
+
+        if self.hole_tracker is None:
+            self.hole_tracker = IncrementalHoles(self.flat_map)
+
+        return self.hole_tracker
+
+    def count_components(self, position_include_fn):
+        # Number of 4-connected components among the in-bounds positions that pass position_include_fn
+        def is_eligible(position):
+            return self.is_position_in_bounds(position) and position_include_fn(position)
 
-                    # We dont use the neighbor position method here - it doesn't support outside-the-box positions
-                    next_set = set(tuple(c) for c in self.get_neighbor_positions(vertex) if position_include_fn(c))
-                    queue.extend(next_set - visited)
+        remaining = set(p for p in self.get_valid_coordinates() if is_eligible(p))
 
-            return visited
+        count = 0
+        while remaining:
+            remaining -= bfs_connected(remaining.pop(), is_eligible, self.get_neighbor_positions)
+            count += 1
 
+        return count
+
+    def check_connected(self, position_include_fn):
         num_eligible = 0
         start_spot = None
 
@@ -172,10 +275,14 @@ class Grid(object):
             return True
 
         # Does a breadth-first search reach all eligible particles?
-        searched = len(bfs(tuple(start_spot)))
+        searched = len(bfs_connected(tuple(start_spot), position_include_fn, self.get_neighbor_positions))
         return searched == num_eligible
 
     def neighbor_count(self, axial_coordinates, classes_to_consider=None):
+        flat_map = self.flat_map
+        if flat_map is not None and classes_to_consider is None:
+            return flat_map.first_degree[flat_map.flat_index(axial_coordinates)]
+
         return len(list(self.get_neighbors(axial_coordinates, classes_to_consider)))
 
     def get_neighbors(self, axial_coordinates, classes_to_consider=None, include_none=False):
@@ -187,13 +294,13 @@ class Grid(object):
 
         return neighbors
 
-    def get_second_degree_neighbors(self, axial_coordinates, degree, classes_to_consider=None):
-        nbrs = self.get_neighbors(axial_coordinates, classes_to_consider)
-
+    def get_second_degree_neighbors(self, axial_coordinates, degree=2, classes_to_consider=None):
+        # Particles can never be adjacent, so second degree neighbors are found through the neighboring positions
         result = set()
 
-        for nbr in nbrs:
-            result |= {x for x in self.get_neighbors(nbr.axial_coordinates, classes_to_consider)}
+        for nbr_position in self.get_neighbor_positions(axial_coordinates):
+            if self.is_position_in_bounds(nbr_position):
+                result |= {x for x in self.get_neighbors(nbr_position, classes_to_consider)}
 
         p = self.get_particle(axial_coordinates, classes_to_consider)
         if p is not None:
@@ -201,7 +308,11 @@ class Grid(object):
 
         return result
 
-    def second_degree_neighbor_count(self, axial_coordinates, degree, classes_to_consider=None):
+    def second_degree_neighbor_count(self, axial_coordinates, degree=2, classes_to_consider=None):
+        flat_map = self.flat_map
+        if flat_map is not None:
+            return flat_map.second_degree[flat_map.flat_index(axial_coordinates)]
+
         return len(self.get_second_degree_neighbors(axial_coordinates, degree, classes_to_consider=None))
 
     def get_neighbor_in_direction(self, axial_coordinates, direction, classes_to_consider=None):
@@ -231,6 +342,10 @@ class Grid(object):
         return center_of_mass if num_particles == 0 else center_of_mass / num_particles
 
     def count_neighborhoods(self, classes_to_consider=None):
+        flat_map = self.flat_map
+        if flat_map is not None and classes_to_consider is None:
+            return flat_map.first_degree_pairs
+
         return sum(self.neighbor_count(p.axial_coordinates, classes_to_consider) for p in
                    self.get_all_particles(classes_to_consider)) / 2
 
@@ -247,7 +362,21 @@ class Grid(object):
             sum(1 for n in self.get_neighbors(p.axial_coordinates, classes_to_consider) if not isinstance(n, type(p)))
             for p in particles) / 2
 
+    def count_second_degree_neighborhoods(self):
+        flat_map = self.flat_map
+        if flat_map is not None:
+            return flat_map.second_degree_pairs
+
+        return sum(self.second_degree_neighbor_count(p.axial_coordinates) for p in self.get_all_particles()) / 2
+
     def count_homogeneous_neighborhoods(self, classes_to_consider):
+        # With a single particle class every neighborhood is homogeneous, so the running total can be used
+        particle_types = [t for t, particles in self._particle_list.get_class_list_pairs() if particles]
+        if self.flat_map is not None and len(particle_types) == 1:
+            if classes_to_consider is None or issubclass(particle_types[0], classes_to_consider):
+                return self.flat_map.first_degree_pairs
+            return 0
+
         particles = self.get_all_particles(classes_to_consider=None)
         return sum(
             sum(1 for n in self.get_neighbors(p.axial_coordinates, classes_to_consider) if isinstance(n, type(p))) for p
@@ -0,0 +1,131 @@
+# coding=utf-8
+import timeit
+
+from . import Directions
+
+# Why a proposal was turned down, in the order move checks them
+BOUNDS = "bounds"
+EXISTING = "existing"
+INVALID = "invalid"
+PROBABILITY = "probability"
+
+REJECTION_REASONS = [BOUNDS, EXISTING, INVALID, PROBABILITY]
+
+# Timed phases of a proposal
+OCCUPANCY = "occupancy"
+VALIDITY = "validity"
+MOVE = "move"
+
+# Timed phases of a block of batched proposals: drawing the block and rejecting blocked targets in bulk, then
+# running the remaining proposals in order
+DRAW = "draw"
+SCAN = "scan"
+
+# The engines AlignmentSimulator.run_iterations picks between, and the phases each of them times
+GENERIC = "generic"
+FLAT = "flat"
+BATCHED = "batched"
+
+ENGINE_PHASES = {GENERIC: [BOUNDS, OCCUPANCY, VALIDITY, PROBABILITY, MOVE],
+                 FLAT: [OCCUPANCY, VALIDITY, PROBABILITY, MOVE],
+                 BATCHED: [DRAW, SCAN]}
+
+DIRECTION_NAMES = ["E", "N", "W", "S"]
+
+
+class _NoTimer(object):
+    def lap(self, phase):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+class _PhaseTimer(object):
+    def __init__(self, totals, counts):
+        self.totals = totals
+        self.counts = counts
+        self.last = timeit.default_timer()
+
+    def lap(self, phase):
+        now = timeit.default_timer()
+        self.totals[phase] += now - self.last
+        self.counts[phase] += 1
+        self.last = now
+
+
+class MoveStatistics(object):
+    """Counters for the instrumented engines of AlignmentSimulator.
+
+    Counts every proposal and acceptance by direction and by bias, and every rejection by reason. With
+    timing_sample_every set, every n-th proposal of the generic and flat engines is also timed phase by phase; the
+    phase timings are averages over the sampled proposals that reached that phase. The batched engine times every
+    block instead, averaged over the proposals in it. Timings are labelled with the engine they measured.
+    """
+
+    def __init__(self, biases=(), timing_sample_every=0, engine=GENERIC):
+        self.engine = engine
+
+        self.rejections = dict((reason, 0) for reason in REJECTION_REASONS)
+        self.direction_proposals = [0] * len(Directions.ALL)
+        self.direction_acceptances = [0] * len(Directions.ALL)
+        self.bias_proposals = dict((bias, 0) for bias in biases)
+        self.bias_acceptances = dict((bias, 0) for bias in biases)
+
+        self.timing_sample_every = timing_sample_every
+        self._until_sample = timing_sample_every
+        self.phase_totals = dict((phase, 0.0) for phase in ENGINE_PHASES[engine])
+        self.phase_counts = dict((phase, 0) for phase in ENGINE_PHASES[engine])
+
+    def start(self, direction_number, bias):
+        self.direction_proposals[direction_number] += 1
+        self.bias_proposals[bias] = self.bias_proposals.get(bias, 0) + 1
+
+        if self.timing_sample_every:
+            self._until_sample -= 1
+            if self._until_sample <= 0:
+                self._until_sample = self.timing_sample_every
+                return _PhaseTimer(self.phase_totals, self.phase_counts)
+
+        return _NO_TIMER
+
+    def reject(self, reason, count=1):
+        self.rejections[reason] += count
+
+    def accept(self, direction_number, bias):
+        self.direction_acceptances[direction_number] += 1
+        self.bias_acceptances[bias] = self.bias_acceptances.get(bias, 0) + 1
+
+    def start_block(self, direction_counts, bias_counts):
+        for number, count in enumerate(direction_counts):
+            self.direction_proposals[number] += count
+
+        for bias, count in bias_counts:
+            self.bias_proposals[bias] = self.bias_proposals.get(bias, 0) + count
+
+    def time_block(self, phase, seconds, proposals):
+        self.phase_totals[phase] += seconds
+        self.phase_counts[phase] += proposals
+
+    @staticmethod
+    def _rate(accepted, proposed):
+        return float(accepted) / proposed if proposed else 0.0
+
+    def get_metric_definitions(self):
+        definitions = [("Rejected (%s)" % reason, "%d", lambda reason=reason: self.rejections[reason])
+                       for reason in REJECTION_REASONS]
+
+        definitions += [("Acceptance rate %s" % name, "%.4f",
+                         lambda n=n: self._rate(self.direction_acceptances[n], self.direction_proposals[n]))
+                        for n, name in enumerate(DIRECTION_NAMES)]
+
+        definitions += [("Acceptance rate at bias %.2f" % bias, "%.4f",
+                         lambda bias=bias: self._rate(self.bias_acceptances.get(bias, 0), self.bias_proposals[bias]))
+                        for bias in sorted(self.bias_proposals)]
+
+        if self.timing_sample_every:
+            definitions += [("Time in %s (us, %s)" % (phase, self.engine), "%.3f",
+                             lambda phase=phase: 1e6 * self.phase_totals[phase] / max(1, self.phase_counts[phase]))
+                            for phase in ENGINE_PHASES[self.engine]]
+
+        return definitions
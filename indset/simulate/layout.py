@@ -0,0 +1,44 @@
+# coding=utf-8
+import numpy as np
+
+from .alignmentsimulator import AlignmentSimulator
+from .grid import Grid
+from .storage import ArrayMap
+
+
+class FlatLayout(object):
+    """The particles of a grid on the flat indices of an ArrayMap, as the starting point of the array based engines.
+
+    map is a fresh ArrayMap holding copies of the particles, for the layout and the starting counts. start holds every
+    particle's flat index, and cells is the map's occupancy with each particle's index into particles rather than its
+    id. Engines keep their own copies of cells, counts and positions; build_grid turns positions back into a grid.
+    """
+
+    def __init__(self, grid):
+        AlignmentSimulator.validate_grid(grid)
+
+        self.size = grid.size
+        self.particles = list(grid.get_all_particles())
+        self.map = ArrayMap(grid.size)
+        for particle in self.particles:
+            self.map[particle.axial_coordinates] = type(particle)(particle.axial_coordinates, particle.id)
+
+        self.start = np.array([self.map.flat_index(p.axial_coordinates) for p in self.particles], dtype=np.int64)
+        self.cells = self.map.occupancy.copy()
+        self.cells[self.start] = np.arange(len(self.particles))
+
+    def build_grid(self, positions):
+        grid = Grid(self.size, ArrayMap)
+        for particle, flat in zip(self.particles, positions):
+            grid.add_particle(type(particle)(self.map.coordinates(flat), particle.id))
+
+        return grid
+
+    def build_simulator(self, positions, bias, iterations_run, movements, rounds=0):
+        # A standalone AlignmentSimulator holding the grid at positions and the given counters
+        simulator = AlignmentSimulator(self.build_grid(positions), bias)
+        simulator.iterations_run = iterations_run
+        simulator.movements = movements
+        simulator.rounds = rounds
+
+        return simulator
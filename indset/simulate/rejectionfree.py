@@ -0,0 +1,180 @@
+# coding=utf-8
+import array
+import math
+
+from .alignmentsimulator import AlignmentSimulator
+from .energy import SHELL_SIZE
+from .storage import ArrayMap
+
+# Every proposal (particle, direction) whose acceptance could change when a cell changes lies within this distance
+INFLUENCE_RADIUS = 3
+
+
+class RejectionFreeSimulator(AlignmentSimulator):
+    """Rejection-free (n-fold way) version of AlignmentSimulator.
+
+    The sequential chain proposes one of the 4n (particle, direction) pairs uniformly per iteration and accepts it
+    with probability min(1, bias ** delta). Here every currently valid move is kept in a bucket by its energy change,
+    so the number of iterations until the next accepted move is drawn from a geometric distribution and the move
+    itself is drawn in proportion to its acceptance probability. iterations_run, movements, rounds and the
+    configurations follow the same distribution as in the sequential chain, but only accepted moves cost any work.
+
+    Needs an ArrayMap backed grid. The bias is the same for all particles, and since rejected proposals are never
+    generated, the probability sink stays empty. The buckets are rebuilt once particles have been added to or removed
+    from the grid, but particles moved other than by this simulator are not supported.
+    """
+
+    def __init__(self, grid, bias, seed=None, probability_sink=None):
+        super(RejectionFreeSimulator, self).__init__(grid, bias, seed=seed, probability_sink=probability_sink)
+
+        if grid.flat_map is None:
+            raise ValueError("RejectionFreeSimulator requires an ArrayMap backed grid.")
+
+        flat_map = grid.flat_map
+        self.influence_offsets = [dx * flat_map.stride + dy
+                                  for dx in xrange(-INFLUENCE_RADIUS, INFLUENCE_RADIUS + 1)
+                                  for dy in xrange(-INFLUENCE_RADIUS, INFLUENCE_RADIUS + 1)
+                                  if abs(dx) + abs(dy) <= INFLUENCE_RADIUS]
+
+        # Acceptance probability of the moves in each bucket, indexed by the energy change plus SHELL_SIZE
+        self.bucket_rates = [min(1.0, self.bias ** delta) for delta in xrange(-SHELL_SIZE, SHELL_SIZE + 1)]
+
+        self._classes_to_move = None
+        self._build_buckets(None)
+
+    def _build_buckets(self, classes_to_move):
+        flat_map = self.grid.flat_map
+
+        self._classes_to_move = classes_to_move
+        self._particle_set_version = self.grid.particle_set_version
+        self._particles = list(self.grid.get_all_particles(classes_to_move))
+        self._positions = [flat_map.flat_index(p.axial_coordinates) for p in self._particles]
+        self._index_of = dict((p.id, i) for i, p in enumerate(self._particles))
+
+        # Each move key i * 4 + direction number sits in at most one bucket; -1 marks an invalid move
+        self._buckets = [[] for _ in self.bucket_rates]
+        self._move_bucket = array.array('i', [-1]) * (4 * len(self._particles))
+        self._move_slot = array.array('i', [0]) * (4 * len(self._particles))
+
+        for i in xrange(len(self._particles)):
+            self._update_moves(i)
+
+    def _update_moves(self, i):
+        flat_map = self.grid.flat_map
+        cells = flat_map.cells
+        first_degree = flat_map.first_degree
+        second_degree = flat_map.second_degree
+
+        current_location = self._positions[i]
+        for number, offset in enumerate(flat_map.direction_offsets):
+            new_location = current_location + offset
+
+            if cells[new_location] != ArrayMap.EMPTY or first_degree[new_location] > 1:
+                bucket = -1
+            else:
+                bucket = second_degree[new_location] - second_degree[current_location] + SHELL_SIZE
+
+            self._set_bucket(4 * i + number, bucket)
+
+    def _set_bucket(self, key, bucket):
+        old_bucket = self._move_bucket[key]
+        if old_bucket == bucket:
+            return
+
+        if old_bucket >= 0:
+            # Swap-remove from the old bucket
+            members = self._buckets[old_bucket]
+            slot = self._move_slot[key]
+            last = members.pop()
+            if last != key:
+                members[slot] = last
+                self._move_slot[last] = slot
+
+        if bucket >= 0:
+            members = self._buckets[bucket]
+            self._move_slot[key] = len(members)
+            members.append(key)
+
+        self._move_bucket[key] = bucket
+
+    def enable_instrumentation(self, timing_sample_every=0):
+        raise ValueError("RejectionFreeSimulator never generates rejected proposals, so there is nothing to "
+                         "instrument.")
+
+    def total_rate(self):
+        return sum(len(members) * rate for members, rate in zip(self._buckets, self.bucket_rates))
+
+    def run_iterations(self, iterations, classes_to_move=None):
+        if classes_to_move != self._classes_to_move or self.grid.particle_set_version != self._particle_set_version:
+            self._build_buckets(classes_to_move)
+
+        flat_map = self.grid.flat_map
+        cells = flat_map.cells
+        rng = self.random
+        proposals = 4.0 * len(self._particles)
+
+        moves_made = 0
+        remaining = iterations
+        while remaining > 0:
+            total_rate = self.total_rate()
+            if total_rate <= 0:
+                break
+
+            # Iterations up to and including the next accepted move. The geometric distribution is memoryless, so a
+            # draw past the end of this call is simply discarded.
+            escape_probability = total_rate / proposals
+            if escape_probability >= 1.0:
+                waiting = 1
+            else:
+                waiting = int(math.log(1.0 - rng.random()) / math.log(1.0 - escape_probability)) + 1
+
+            if waiting > remaining:
+                break
+
+            remaining -= waiting
+            self.iterations_run += waiting
+
+            # Choose a bucket in proportion to its total rate, then a move uniformly within it
+            target = rng.random() * total_rate
+            for bucket, rate in enumerate(self.bucket_rates):
+                weight = len(self._buckets[bucket]) * rate
+                if target < weight:
+                    break
+                target -= weight
+
+            members = self._buckets[bucket]
+            while not members:
+                # Only reachable through floating point round-off on the last bucket
+                bucket -= 1
+                members = self._buckets[bucket]
+
+            key = members[int(rng.random() * len(members))]
+            i, number = divmod(key, 4)
+
+            current_location = self._positions[i]
+            new_location = current_location + flat_map.direction_offsets[number]
+            flat_map.move_flat(current_location, new_location)
+            self._positions[i] = new_location
+
+            if self.trajectory_recorder is not None:
+                self.trajectory_recorder.record(self.iterations_run, self._particles[i].id, number)
+
+            self.record_movement(self._particles[i], classes_to_move)
+            moves_made += 1
+
+            # Refresh every move whose validity or energy change could depend on the two changed cells
+            touched = set()
+            for center in (current_location, new_location):
+                for offset in self.influence_offsets:
+                    identifier = cells[center + offset]
+                    if identifier >= 0:
+                        touched.add(identifier)
+
+            for identifier in touched:
+                j = self._index_of.get(identifier)
+                if j is not None:
+                    self._update_moves(j)
+
+        self.iterations_run += remaining
+
+        return moves_made
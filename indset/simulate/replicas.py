@@ -0,0 +1,127 @@
+# coding=utf-8
+import numpy as np
+
+from .energy import LocalEnergyTable, SHELL_SIZE
+from .layout import FlatLayout
+from .storage import ArrayMap
+
+
+class ReplicaSimulator(object):
+    """Runs K independent AlignmentSimulator chains from the same starting grid as one set of stacked arrays.
+
+    Cells, per-cell first and second degree counts and particle positions are kept as (K, cells) and (K, particles)
+    arrays on the ArrayMap layout. Every step makes one proposal in every replica with a handful of numpy operations,
+    so the interpreter overhead of a step is shared by all replicas. Each replica follows the same chain as the
+    sequential AlignmentSimulator, with its own proposals drawn from a shared numpy random state.
+
+    Move probabilities are not recorded.
+    """
+
+    def __init__(self, grid, bias, replicas, seed=None, block_size=4096):
+        self.layout = FlatLayout(grid)
+        self.particles = self.layout.particles
+
+        self.size = grid.size
+        self.bias = float(bias)
+        self.replicas = replicas
+        self.block_size = block_size
+        self.random_state = np.random.RandomState(seed)
+
+        flat_map = self.layout.map
+        self.cell_count = len(flat_map.cells)
+        self.ids = np.array([p.id for p in self.particles], dtype=np.int32)
+
+        self.cells = np.tile(self.layout.cells, (replicas, 1))
+        self.first_degree = np.tile(np.frombuffer(flat_map.first_degree, dtype=np.int32), (replicas, 1))
+        self.second_degree = np.tile(np.frombuffer(flat_map.second_degree, dtype=np.int32), (replicas, 1))
+        self.positions = np.tile(self.layout.start, (replicas, 1))
+
+        self.second_degree_pairs = np.full(replicas, flat_map.second_degree_pairs, dtype=np.int64)
+        self.movements = np.zeros(replicas, dtype=np.int64)
+        self.rounds = np.zeros(replicas, dtype=np.int64)
+        self.visited = np.zeros((replicas, len(self.particles)), dtype=bool)
+        self.unvisited = np.full(replicas, len(self.particles), dtype=np.int64)
+        self.iterations_run = 0
+
+        self.direction_offsets = np.array(flat_map.direction_offsets, dtype=np.int64)
+        self.neighbor_offsets = np.array(flat_map.neighbor_offsets, dtype=np.int64)
+        self.shell_offsets = np.array(flat_map.shell_offsets, dtype=np.int64)
+        self.probabilities = np.array(LocalEnergyTable.for_bias(self.bias).delta_probabilities)
+
+    def run_iterations(self, iterations):
+        # Each iteration is one proposal in every replica
+        replica_range = np.arange(self.replicas)
+        row_starts = replica_range * self.cell_count
+
+        cells = self.cells.ravel()
+        first_degree = self.first_degree.ravel()
+        second_degree = self.second_degree.ravel()
+        positions = self.positions
+        empty = ArrayMap.EMPTY
+
+        moves_made = 0
+        remaining = iterations
+        while remaining > 0:
+            block = min(remaining, self.block_size)
+            indices = self.random_state.randint(len(self.particles), size=(block, self.replicas))
+            directions = self.random_state.randint(len(self.direction_offsets), size=(block, self.replicas))
+            uniforms = self.random_state.random_sample((block, self.replicas))
+
+            for t in xrange(block):
+                i = indices[t]
+                current = positions[replica_range, i] + row_starts
+                new = current + self.direction_offsets[directions[t]]
+
+                delta = second_degree[new] - second_degree[current]
+                accepted = (cells[new] == empty) & (first_degree[new] <= 1) & \
+                    (uniforms[t] < self.probabilities[delta + SHELL_SIZE])
+
+                if not accepted.any():
+                    continue
+
+                k = replica_range[accepted]
+                i = i[accepted]
+                current = current[accepted]
+                new = new[accepted]
+
+                # The same bookkeeping as ArrayMap.move_flat; replicas never share cells, so no index repeats
+                self.second_degree_pairs[k] -= second_degree[current]
+                cells[current] = empty
+                first_degree[current[:, np.newaxis] + self.neighbor_offsets] -= 1
+                second_degree[current[:, np.newaxis] + self.shell_offsets] -= 1
+
+                cells[new] = i
+                first_degree[new[:, np.newaxis] + self.neighbor_offsets] += 1
+                second_degree[new[:, np.newaxis] + self.shell_offsets] += 1
+                self.second_degree_pairs[k] += second_degree[new]
+
+                positions[k, i] = new - row_starts[k]
+                self.movements[k] += 1
+                moves_made += len(k)
+
+                # Round tracking, as in VisitTracker
+                first_visit = ~self.visited[k, i]
+                self.visited[k[first_visit], i[first_visit]] = True
+                self.unvisited[k[first_visit]] -= 1
+
+                completed = k[self.unvisited[k] == 0]
+                if len(completed):
+                    self.rounds[completed] += 1
+                    self.visited[completed] = False
+                    self.unvisited[completed] = len(self.particles)
+
+            self.iterations_run += block
+            remaining -= block
+
+        return moves_made
+
+    def get_grid(self, replica):
+        return self.layout.build_grid(self.positions[replica].tolist())
+
+    def get_simulator(self, replica):
+        # A standalone AlignmentSimulator holding the replica's grid and counters
+        return self.layout.build_simulator(self.positions[replica].tolist(), self.bias, self.iterations_run,
+                                           int(self.movements[replica]), int(self.rounds[replica]))
+
+    def get_metrics(self, replica):
+        return self.get_simulator(replica).get_metrics()
@@ -0,0 +1,186 @@
+# coding=utf-8
+import os
+
+import numpy as np
+
+
+class StreamingStatistics(object):
+    """Constant-memory sink for a long stream of floats, such as the move probabilities of a simulation.
+
+    Values are buffered and folded into the running count, mean, variance and histogram one chunk at a time. A
+    fixed-size reservoir sample and a float32 spill file holding every value can be enabled on top.
+    """
+
+    def __init__(self, bins=None, reservoir_size=0, spill_path=None, chunk_size=65536, seed=None):
+        self.bins = np.logspace(-10, 10, 201) if bins is None else np.asarray(bins, dtype=float)
+        self.chunk_size = chunk_size
+
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+        self.histogram_counts = np.zeros(len(self.bins) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+        self.reservoir_size = reservoir_size
+        self._reservoir = np.empty(reservoir_size)
+        self._random_state = np.random.RandomState(seed)
+
+        self.spill_path = spill_path
+        self.spilled = 0
+        if spill_path is not None:
+            open(spill_path, "wb").close()
+
+        self._buffer = []
+
+    def append(self, value):
+        self._buffer.append(value)
+
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, values):
+        self._buffer.extend(values)
+
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def __len__(self):
+        return self._count + len(self._buffer)
+
+    def flush(self):
+        if not self._buffer:
+            return
+
+        chunk = np.array(self._buffer, dtype=float)
+        self._buffer = []
+
+        self._update_moments(chunk)
+        self._update_histogram(chunk)
+
+        if self.reservoir_size:
+            self._update_reservoir(chunk)
+
+        if self.spill_path is not None:
+            self._spill(chunk)
+
+        self._count += len(chunk)
+
+    def _update_moments(self, chunk):
+        # Chan et al.'s pairwise update of the running mean and sum of squared deviations
+        n = len(chunk)
+        chunk_mean = chunk.mean()
+        chunk_m2 = ((chunk - chunk_mean) ** 2).sum()
+
+        total = self._count + n
+        delta = chunk_mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += chunk_m2 + delta ** 2 * self._count * n / total
+
+        chunk_min = chunk.min()
+        chunk_max = chunk.max()
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+    def _update_histogram(self, chunk):
+        counts, _ = np.histogram(chunk, self.bins)
+        self.histogram_counts += counts
+        self.underflow += int((chunk < self.bins[0]).sum())
+        self.overflow += int((chunk > self.bins[-1]).sum())
+
+    def _update_reservoir(self, chunk):
+        # Algorithm R: the value with stream index t replaces a random slot with probability k / (t + 1)
+        k = self.reservoir_size
+        indices = np.arange(self._count, self._count + len(chunk))
+
+        filling = indices < k
+        self._reservoir[indices[filling]] = chunk[filling]
+
+        slots = (self._random_state.random_sample(len(chunk)) * (indices + 1)).astype(np.int64)
+        for position in np.flatnonzero(~filling & (slots < k)):
+            self._reservoir[slots[position]] = chunk[position]
+
+    def _spill(self, chunk):
+        offset = self.spilled * np.dtype(np.float32).itemsize
+
+        with open(self.spill_path, "r+b") as f:
+            f.truncate(offset + len(chunk) * np.dtype(np.float32).itemsize)
+
+        spill = np.memmap(self.spill_path, dtype=np.float32, mode="r+", offset=offset, shape=(len(chunk),))
+        spill[:] = chunk
+        spill.flush()
+        del spill
+
+        self.spilled += len(chunk)
+
+    @property
+    def count(self):
+        return len(self)
+
+    @property
+    def mean(self):
+        self.flush()
+        return self._mean
+
+    @property
+    def variance(self):
+        self.flush()
+        return self._m2 / self._count if self._count > 0 else 0.0
+
+    def histogram(self):
+        self.flush()
+        return self.histogram_counts.copy(), self.bins.copy()
+
+    def sample(self):
+        self.flush()
+        return self._reservoir[:min(self._count, self.reservoir_size)].copy()
+
+    def get_state(self):
+        # Aggregates, reservoir and random state as numpy arrays, for checkpoints; the spill file is left as it is
+        self.flush()
+        _, keys, position, has_gauss, cached_gaussian = self._random_state.get_state()
+
+        return {
+            "bins": self.bins,
+            "moments": np.array([self._count, self._mean, self._m2,
+                                 np.nan if self.min is None else self.min, np.nan if self.max is None else self.max]),
+            "histogram": np.append(self.histogram_counts, [self.underflow, self.overflow]),
+            "reservoir": self.sample(),
+            "random_keys": keys,
+            "random_state": np.array([position, has_gauss, cached_gaussian]),
+        }
+
+    def set_state(self, state):
+        # Restores get_state output. A spill file keeps only the values appended from here on.
+        if not np.array_equal(state["bins"], self.bins):
+            raise ValueError("The saved statistics use different histogram bins.")
+
+        self._buffer = []
+        count, self._mean, self._m2, minimum, maximum = state["moments"].tolist()
+        self._count = int(count)
+        self.min = None if np.isnan(minimum) else minimum
+        self.max = None if np.isnan(maximum) else maximum
+
+        histogram = state["histogram"]
+        self.histogram_counts = histogram[:-2].astype(np.int64)
+        self.underflow, self.overflow = histogram[-2:].tolist()
+
+        reservoir = state["reservoir"][:self.reservoir_size]
+        self._reservoir[:len(reservoir)] = reservoir
+
+        position, has_gauss, cached_gaussian = state["random_state"].tolist()
+        self._random_state.set_state(("MT19937", state["random_keys"], int(position), int(has_gauss),
+                                      cached_gaussian))
+
+    def close(self):
+        self.flush()
+
+
+def load_spill(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    return np.memmap(path, dtype=np.float32, mode="r")
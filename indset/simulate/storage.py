@@ -1,6 +1,9 @@
 # coding=utf-8
+import array
 from collections import defaultdict
 
+import numpy as np
+
 
 class ListMap(object):
     def __init__(self, size):
@@ -50,27 +53,309 @@ class ListMap(object):
 
         self._grid_array[x][y] = None
 
+
+class ArrayMap(object):
+    """Stores particle ids in a padded, contiguous int32 array addressed by flat indices.
+
+    Cells outside the grid bounds hold WALL, so a single lookup tells whether a position is
+    free, blocked or occupied. The padding keeps every lookup up to PADDING steps away from an
+    in-bounds cell inside the array.
+    """
+    EMPTY = -1
+    WALL = -2
+
+    PADDING = 3
+
+    def __init__(self, size):
+        self.size = tuple(size)
+        self.width = size[0]
+        self.height = size[1]
+
+        self.min = tuple(x / -2 for x in self.size)
+        self.max = tuple(x / 2 for x in self.size)
+
+        self._x_offset = self.PADDING - self.min[0]
+        self._y_offset = self.PADDING - self.min[1]
+
+        self.shape = (self.max[0] - self.min[0] + 1 + 2 * self.PADDING,
+                      self.max[1] - self.min[1] + 1 + 2 * self.PADDING)
+        self.stride = self.shape[1]
+
+        # The array.array gives fast scalar access from Python; the numpy view shares its memory
+        self.cells = array.array('i', [self.WALL]) * (self.shape[0] * self.shape[1])
+        self.occupancy = np.frombuffer(self.cells, dtype=np.int32)
+        self.occupancy.reshape(self.shape)[self._x_offset + self.min[0] + 1:self._x_offset + self.max[0],
+                                           self._y_offset + self.min[1] + 1:self._y_offset + self.max[1]] = self.EMPTY
+
+        # Flat offsets for each direction number, the four neighbors and the second degree shell
+        self.direction_offsets = [self.stride, 1, -self.stride, -1]
+        self.neighbor_offsets = list(self.direction_offsets)
+        self.shell_offsets = [2 * self.stride, -2 * self.stride, 2, -2,
+                              self.stride + 1, self.stride - 1, -self.stride + 1, -self.stride - 1]
+
+        # Number of particles adjacent to / in the second degree shell of every cell, kept up to date on every change
+        self.first_degree = array.array('i', [0]) * len(self.cells)
+        self.second_degree = array.array('i', [0]) * len(self.cells)
+        self.first_degree_pairs = 0
+        self.second_degree_pairs = 0
+
+        self._particles = {}
+        self._observers = []
+
+    def add_observer(self, observer):
+        # Observers get particle_added(flat), particle_removed(flat) and particle_moved(old_flat, new_flat) calls,
+        # made once the cells already show the change
+        self._observers.append(observer)
+
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
+
+    def flat_index(self, key):
+        x = key[0] + self._x_offset
+        y = key[1] + self._y_offset
+
+        if x < 0 or y < 0 or x >= self.shape[0] or y >= self.shape[1]:
+            raise ValueError("Index out of bounds!")
+
+        return x * self.stride + y
+
+    def coordinates(self, flat):
+        x, y = divmod(flat, self.stride)
+        return x - self._x_offset, y - self._y_offset
+
+    def grid_view(self):
+        return self.occupancy.reshape(self.shape)
+
+    def get_particle_by_id(self, identifier):
+        return self._particles[identifier]
+
+    def get_flat(self, flat):
+        identifier = self.cells[flat]
+        return None if identifier < 0 else self._particles[identifier]
+
+    def _add_counts(self, flat):
+        first_degree = self.first_degree
+        second_degree = self.second_degree
+
+        for offset in self.neighbor_offsets:
+            first_degree[flat + offset] += 1
+        for offset in self.shell_offsets:
+            second_degree[flat + offset] += 1
+
+        self.first_degree_pairs += first_degree[flat]
+        self.second_degree_pairs += second_degree[flat]
+
+    def _remove_counts(self, flat):
+        first_degree = self.first_degree
+        second_degree = self.second_degree
+
+        self.first_degree_pairs -= first_degree[flat]
+        self.second_degree_pairs -= second_degree[flat]
+
+        for offset in self.neighbor_offsets:
+            first_degree[flat + offset] -= 1
+        for offset in self.shell_offsets:
+            second_degree[flat + offset] -= 1
+
+    def add_particles(self, flats, particles):
+        # Places many particles at once: the cells are filled by fancy indexing and every count is rebuilt from the
+        # occupancy with one shifted add per offset, instead of per-particle updates
+        flats = np.asarray(flats, dtype=np.int64)
+        ids = np.array([p.id for p in particles], dtype=np.int64)
+
+        if len(flats) != len(ids):
+            raise ValueError("Need one flat index per particle")
+
+        if len(ids) and (ids.min() < 0 or ids.max() >= 2 ** 31 - 1):
+            raise ValueError("ArrayMap requires non-negative int32 particle ids")
+
+        if len(np.unique(ids)) != len(ids) or any(identifier in self._particles for identifier in ids.tolist()):
+            raise ValueError("ArrayMap requires unique particle ids")
+
+        if len(np.unique(flats)) != len(flats) or np.any(self.occupancy[flats] != self.EMPTY):
+            raise ValueError("Positions need to be free, distinct and in bounds")
+
+        self.occupancy[flats] = ids
+        self._particles.update(zip(ids.tolist(), particles))
+        self._recount()
+
+        for observer in self._observers:
+            for flat in flats.tolist():
+                observer.particle_added(flat)
+
+    def _recount(self):
+        occupied = self.occupancy >= 0
+        weights = occupied.astype(np.int32)
+
+        for counts, offsets in ((self.first_degree, self.neighbor_offsets), (self.second_degree, self.shell_offsets)):
+            view = np.frombuffer(counts, dtype=np.int32)
+            view[:] = 0
+
+            # counts[c] is the number of particles at c + offset, for every offset
+            for offset in offsets:
+                if offset > 0:
+                    view[:-offset] += weights[offset:]
+                else:
+                    view[-offset:] += weights[:offset]
+
+        # Every pair is seen from both of its particles
+        self.first_degree_pairs = int(np.frombuffer(self.first_degree, dtype=np.int32)[occupied].sum()) // 2
+        self.second_degree_pairs = int(np.frombuffer(self.second_degree, dtype=np.int32)[occupied].sum()) // 2
+
+    def move_flat(self, old_flat, new_flat):
+        identifier = self.cells[old_flat]
+
+        self.cells[old_flat] = self.EMPTY
+        self._remove_counts(old_flat)
+        self.cells[new_flat] = identifier
+        self._add_counts(new_flat)
+
+        particle = self._particles[identifier]
+        particle.move(self.coordinates(new_flat))
+
+        if self._observers:
+            for observer in self._observers:
+                observer.particle_moved(old_flat, new_flat)
+
+        return particle
+
+    def __getitem__(self, key):
+        identifier = self.cells[self.flat_index(key)]
+        return None if identifier < 0 else self._particles[identifier]
+
+    def __setitem__(self, key, value):
+        flat = self.flat_index(key)
+
+        if self.cells[flat] == self.WALL:
+            raise ValueError("Index out of bounds!")
+
+        if value is not None:
+            existing = self._particles.get(value.id)
+            if existing is not None and existing is not value:
+                raise ValueError("ArrayMap requires unique particle ids")
+
+            if not 0 <= value.id < 2 ** 31 - 1:
+                raise ValueError("ArrayMap requires non-negative int32 particle ids")
+
+        if self.cells[flat] >= 0:
+            self._remove_counts(flat)
+            self.cells[flat] = self.EMPTY
+            for observer in self._observers:
+                observer.particle_removed(flat)
+
+        if value is None:
+            self.cells[flat] = self.EMPTY
+            return
+
+        self._particles[value.id] = value
+        self.cells[flat] = value.id
+        self._add_counts(flat)
+
+        for observer in self._observers:
+            observer.particle_added(flat)
+
+    def __delitem__(self, key):
+        flat = self.flat_index(key)
+
+        if self.cells[flat] == self.WALL:
+            raise ValueError("Index out of bounds!")
+
+        identifier = self.cells[flat]
+        if identifier >= 0:
+            del self._particles[identifier]
+            self._remove_counts(flat)
+            self.cells[flat] = self.EMPTY
+            for observer in self._observers:
+                observer.particle_removed(flat)
+
+
+class VisitTracker(object):
+    """Tracks which particles have moved in the current round.
+
+    Each particle id maps to a slot holding the generation it was last visited in, so starting a new round only
+    bumps the generation instead of clearing the marks.
+    """
+    MAX_GENERATION = 2 ** 32 - 1
+
+    def __init__(self, identifiers):
+        self._slots = {}
+        for identifier in identifiers:
+            self._slots[identifier] = len(self._slots)
+
+        self._marks = array.array('L', [0]) * len(self._slots)
+        self.generation = 1
+        self.unvisited = len(self._slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def visit(self, identifier):
+        # Returns True if this visit completed a round
+        slot = self._slots.get(identifier)
+
+        if slot is None:
+            return not self._slots
+
+        if self._marks[slot] == self.generation:
+            return False
+
+        self._marks[slot] = self.generation
+        self.unvisited -= 1
+
+        if self.unvisited > 0:
+            return False
+
+        self.new_round()
+        return True
+
+    def is_visited(self, identifier):
+        return self._marks[self._slots[identifier]] == self.generation
+
+    def new_round(self):
+        if self.generation == self.MAX_GENERATION:
+            self._marks = array.array('L', [0]) * len(self._slots)
+            self.generation = 0
+
+        self.generation += 1
+        self.unvisited = len(self._slots)
+
+
 class ClassBasedList(object):
     def __init__(self):
         self._particle_list = []
+        self._particle_set = set()
         self._particle_class_lists = defaultdict(list)
 
     def add(self, particle):
-        if particle in self._particle_list:
+        if particle in self._particle_set:
             raise ValueError("This particle is already in the list.")
 
         self._particle_list.append(particle)
+        self._particle_set.add(particle)
         self._particle_class_lists[type(particle)].append(particle)
 
+    def extend(self, particles):
+        particles = list(particles)
+        new_set = set(particles)
+
+        if len(new_set) != len(particles) or not new_set.isdisjoint(self._particle_set):
+            raise ValueError("This particle is already in the list.")
+
+        self._particle_list.extend(particles)
+        self._particle_set |= new_set
+        for klass in set(type(p) for p in particles):
+            self._particle_class_lists[klass].extend(p for p in particles if type(p) is klass)
+
     def remove(self, particle):
-        if particle not in self._particle_list:
+        if particle not in self._particle_set:
             raise ValueError("This particle is not in the list.")
 
         self._particle_list.remove(particle)
+        self._particle_set.remove(particle)
         self._particle_class_lists[type(particle)].remove(particle)
 
     def __contains__(self, item):
-        return item in self._particle_list
+        return item in self._particle_set
 
     def get_all(self):
         return (x for x in self._particle_list)
@@ -0,0 +1,196 @@
+# coding=utf-8
+import array
+import struct
+import threading
+import zlib
+from Queue import Queue
+
+import numpy as np
+
+from .grid import Grid, Particle, Directions
+from .storage import ListMap
+
+# File layout: a header with the grid size, the particle ids and their indices into the particle types (the types
+# only from version 2 on), then a sequence of blocks. Every block has a
+# BLOCK header (kind, first iteration, last iteration, compressed length) followed by zlib-compressed data:
+# EVENTS blocks hold EVENT_DTYPE records, KEYFRAME blocks the int32 coordinates of every particle in header order.
+MAGIC = b"ITRJ"
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = struct.Struct("<4sIiiq")
+BLOCK = struct.Struct("<cqqq")
+
+EVENTS = b"E"
+KEYFRAME = b"K"
+
+EVENT_DTYPE = np.dtype([("iteration", "<i8"), ("particle", "<i4"), ("direction", "i1")])
+
+DIRECTION_VECTORS = np.array([d.axial_vector() for d in Directions.ALL], dtype=np.int32)
+
+
+class TrajectoryRecorder(object):
+    """Logs every accepted move of a simulator as (iteration, particle id, direction number).
+
+    Events are buffered into fixed-size chunks which a background thread compresses and writes, so recording never
+    waits on the disk. A keyframe with every particle's position is written every keyframe_interval events so that
+    TrajectoryReader can seek without replaying the whole run. Iterations count completed iterations: an event
+    recorded at iteration t is part of the state after t iterations.
+    """
+
+    def __init__(self, filename, grid, iteration=0, chunk_size=65536, keyframe_interval=1000000, compression=6,
+                 particle_types=(Particle,)):
+        self.grid = grid
+        self.chunk_size = chunk_size
+        self.keyframe_interval = keyframe_interval
+        self.compression = compression
+
+        self._particles = list(grid.get_all_particles())
+        self._file = open(filename, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, grid.size[0], grid.size[1], len(self._particles)))
+        self._file.write(np.array([p.id for p in self._particles], dtype="<i4").tobytes())
+        self._file.write(np.array([particle_types.index(type(p)) for p in self._particles], dtype="<i4").tobytes())
+
+        self._iterations = array.array('l')
+        self._ids = array.array('i')
+        self._directions = array.array('b')
+        self._since_keyframe = 0
+
+        self._queue = Queue()
+        self._writer = threading.Thread(target=self._write_blocks)
+        self._writer.daemon = True
+        self._writer.start()
+
+        self._queue_keyframe(iteration)
+
+    def record(self, iteration, particle_id, direction_number):
+        self._iterations.append(iteration)
+        self._ids.append(particle_id)
+        self._directions.append(direction_number)
+
+        if len(self._ids) >= self.chunk_size:
+            self._queue_events()
+
+        self._since_keyframe += 1
+        if self._since_keyframe >= self.keyframe_interval:
+            self._queue_events()
+            self._queue_keyframe(iteration)
+
+    def _queue_events(self):
+        if not self._ids:
+            return
+
+        events = np.empty(len(self._ids), dtype=EVENT_DTYPE)
+        events["iteration"] = np.frombuffer(self._iterations, dtype=np.dtype('l'))
+        events["particle"] = np.frombuffer(self._ids, dtype=np.int32)
+        events["direction"] = np.frombuffer(self._directions, dtype=np.int8)
+
+        self._iterations = array.array('l')
+        self._ids = array.array('i')
+        self._directions = array.array('b')
+
+        self._queue.put((EVENTS, int(events["iteration"][0]), int(events["iteration"][-1]), events))
+
+    def _queue_keyframe(self, iteration):
+        coordinates = np.array([p.axial_coordinates for p in self._particles], dtype="<i4").reshape(-1, 2)
+        self._queue.put((KEYFRAME, iteration, iteration, coordinates))
+        self._since_keyframe = 0
+
+    def _write_blocks(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+
+            kind, first, last, data = block
+            payload = zlib.compress(data.tobytes(), self.compression)
+            self._file.write(BLOCK.pack(kind, first, last, len(payload)))
+            self._file.write(payload)
+
+    def close(self, iteration=None):
+        # Optionally finish with a keyframe at the final iteration, which makes seeking to the end instant
+        self._queue_events()
+        if iteration is not None:
+            self._queue_keyframe(iteration)
+
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+class TrajectoryReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as f:
+            magic, version, width, height, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("%s is not a trajectory file" % filename)
+            if version not in SUPPORTED_VERSIONS:
+                raise ValueError("Unsupported trajectory version %d" % version)
+
+            self.size = (width, height)
+            self.ids = np.frombuffer(f.read(4 * count), dtype="<i4").copy()
+
+            # Version 1 files hold no types, so all of their particles are of the first type
+            if version >= 2:
+                self.types = np.frombuffer(f.read(4 * count), dtype="<i4").copy()
+            else:
+                self.types = np.zeros(count, dtype="<i4")
+
+            # Index the blocks without decompressing them
+            self.blocks = []
+            while True:
+                header = f.read(BLOCK.size)
+                if len(header) < BLOCK.size:
+                    break
+
+                kind, first, last, length = BLOCK.unpack(header)
+                self.blocks.append((kind, first, last, f.tell(), length))
+                f.seek(length, 1)
+
+        self._slot_of = np.full(self.ids.max() + 1 if count else 0, -1, dtype=np.int64)
+        self._slot_of[self.ids] = np.arange(count)
+
+    def _read_block(self, f, offset, length):
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    @property
+    def last_iteration(self):
+        return max(last for _, _, last, _, _ in self.blocks)
+
+    def events(self, start=0, end=None):
+        # All events with start < iteration <= end, in order
+        with open(self.filename, "rb") as f:
+            for kind, first, last, offset, length in self.blocks:
+                if kind != EVENTS or last <= start or (end is not None and first > end):
+                    continue
+
+                events = np.frombuffer(self._read_block(f, offset, length), dtype=EVENT_DTYPE)
+                selected = events["iteration"] > start
+                if end is not None:
+                    selected &= events["iteration"] <= end
+                yield events[selected]
+
+    def coordinates_at(self, iteration):
+        # Start from the last keyframe at or before the iteration and add up the moves made since
+        keyframes = [b for b in self.blocks if b[0] == KEYFRAME and b[1] <= iteration]
+        if not keyframes:
+            raise ValueError("The trajectory starts after iteration %d" % iteration)
+
+        _, keyframe_iteration, _, offset, length = keyframes[-1]
+        with open(self.filename, "rb") as f:
+            coordinates = np.frombuffer(self._read_block(f, offset, length), dtype="<i4").reshape(-1, 2).copy()
+
+        for events in self.events(keyframe_iteration, iteration):
+            np.add.at(coordinates, self._slot_of[events["particle"]], DIRECTION_VECTORS[events["direction"]])
+
+        return coordinates
+
+    def grid_at(self, iteration, particle_types=(Particle,), map_backend=ListMap):
+        grid = Grid(self.size, map_backend)
+        for identifier, position, ptype in zip(self.ids.tolist(), self.coordinates_at(iteration).tolist(),
+                                               self.types.tolist()):
+            grid.add_particle(particle_types[ptype](position, identifier))
+
+        return grid
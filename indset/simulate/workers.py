@@ -0,0 +1,77 @@
+# coding=utf-8
+import multiprocessing
+import traceback
+
+
+def serve(connection, start, *arguments):
+    # Worker side: start(*arguments) sets the worker up and returns its command handlers, then every (command,
+    # argument) request is answered with ("ok", result) until "stop", or with ("error", traceback) on failure
+    try:
+        handlers = start(*arguments)
+        connection.send(("ok", None))
+
+        while True:
+            command, argument = connection.recv()
+
+            if command == "stop":
+                connection.send(("ok", None))
+                break
+            elif command not in handlers:
+                raise ValueError("Unknown command %s" % command)
+
+            connection.send(("ok", handlers[command](argument)))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+class WorkerPool(object):
+    """Daemonic worker processes, each answering requests over its own pipe.
+
+    Every worker runs serve with start and its own tuple of arguments. Workers are forked, so they inherit shared
+    memory that exists when the pool is created. The pool waits until every worker is set up, so that a failing setup
+    raises here rather than at the first request.
+    """
+
+    def __init__(self, start, worker_arguments):
+        self.connections = []
+        self.workers = []
+        for arguments in worker_arguments:
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=serve, args=(child, start) + tuple(arguments))
+            worker.daemon = True
+            worker.start()
+            child.close()
+
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+        self.collect(range(len(self.workers)))
+
+    def __len__(self):
+        return len(self.workers)
+
+    def request_all(self, requests):
+        # Sends (worker, command, argument) requests, then collects the answers, so that the workers run concurrently
+        for worker, command, argument in requests:
+            self.connections[worker].send((command, argument))
+
+        return self.collect([worker for worker, _, _ in requests])
+
+    def collect(self, workers):
+        results = []
+        for worker in workers:
+            status, result = self.connections[worker].recv()
+            if status != "ok":
+                raise RuntimeError("Worker %d failed:\n%s" % (worker, result))
+            results.append(result)
+
+        return results
+
+    def close(self):
+        try:
+            self.request_all([(w, "stop", None) for w in xrange(len(self.workers))])
+        finally:
+            for worker in self.workers:
+                worker.join()
@@ -0,0 +1,161 @@
+# coding=utf-8
+import csv
+import errno
+import itertools
+import multiprocessing
+import os
+import Queue
+import time
+import traceback
+from collections import deque, namedtuple
+
+from indset.io import alignment_simulator_grid_loader, alignment_simulator_grid_saver, MetricsRecorder, \
+    save_checkpoint, load_checkpoint
+from indset.simulate import AlignmentSimulator, ArrayMap
+
+SweepJob = namedtuple("SweepJob", ["input_file", "bias", "seed"])
+
+
+def make_jobs(input_files, biases, seeds):
+    return [SweepJob(f, b, s) for f, b, s in itertools.product(input_files, sorted(biases), seeds)]
+
+
+def get_job_path(root_dir, job):
+    model_name = os.path.splitext(os.path.basename(job.input_file))[0]
+    sim_name = "lambda-%.2f--seed-%d" % (job.bias, job.seed)
+
+    return os.path.join(root_dir, model_name, sim_name)
+
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def run_job(job, root_dir, total_iterations, unit_iterations, batch_size=65536, plot=False, checkpoint=False):
+    path = get_job_path(root_dir, job)
+    mkdir_p(path)
+
+    # With checkpointing on, a job that was interrupted picks up exactly where its last checkpoint left off
+    checkpoint_file = os.path.join(path, "checkpoint.npz")
+    resumed = checkpoint and os.path.exists(checkpoint_file)
+
+    if resumed:
+        sim = load_checkpoint(checkpoint_file)
+        grid = sim.grid
+        print "Resuming %s from iteration %d" % (path, sim.iterations_run)
+    else:
+        grid = alignment_simulator_grid_loader(job.input_file, map_backend=ArrayMap)
+        sim = AlignmentSimulator(grid, job.bias, seed=job.seed, batch_size=batch_size)
+
+    plotter = None
+    if plot:
+        # Imported here so that sweeps without plots don't need cairo
+        from indset.plot import VectorPlotter, PlotPipeline
+        plotter = PlotPipeline(sim, VectorPlotter, path)
+        if not resumed:
+            plotter.plot("%d.pdf" % sim.iterations_run)
+
+    metrics = MetricsRecorder(sim, os.path.join(path, "metrics"), append=resumed)
+    if not resumed:
+        metrics.record()
+
+    start = time.time()
+    while sim.iterations_run < total_iterations:
+        sim.run_iterations(min(unit_iterations, total_iterations - sim.iterations_run))
+        metrics.record()
+
+        if plotter is not None:
+            plotter.plot("%d.pdf" % sim.iterations_run)
+
+        if checkpoint:
+            metrics.flush()
+            save_checkpoint(checkpoint_file, sim)
+
+    metrics.close()
+    if plotter is not None:
+        plotter.close()
+
+    alignment_simulator_grid_saver(os.path.join(path, "final.txt"), grid)
+
+    return job, sim.get_metrics(), time.time() - start
+
+
+def _job_process(number, job, result_queue, job_options):
+    try:
+        result_queue.put((number, "ok", run_job(job, **job_options)))
+    except Exception:
+        result_queue.put((number, "error", traceback.format_exc()))
+
+
+def run_jobs(jobs, processes, **job_options):
+    # Runs every job in a fresh, non-daemonic process, at most processes at a time, and yields run_job's results as
+    # jobs finish. Unlike pool workers, these processes may start processes of their own, such as a PlotPipeline's.
+    result_queue = multiprocessing.Queue()
+    waiting = deque(enumerate(jobs))
+    running = {}
+
+    try:
+        while waiting or running:
+            while waiting and len(running) < processes:
+                number, job = waiting.popleft()
+                running[number] = multiprocessing.Process(target=_job_process,
+                                                          args=(number, job, result_queue, job_options))
+                running[number].start()
+
+            try:
+                number, status, result = result_queue.get(timeout=1)
+            except Queue.Empty:
+                for number, process in running.items():
+                    if not process.is_alive() and process.exitcode != 0:
+                        raise RuntimeError("Sweep job %d exited with code %d" % (number, process.exitcode))
+                continue
+
+            running.pop(number).join()
+            if status != "ok":
+                raise RuntimeError("Sweep job %d failed:\n%s" % (number, result))
+
+            yield result
+    finally:
+        for process in running.values():
+            process.terminate()
+            process.join()
+
+
+def run_sweep(jobs, root_dir, total_iterations, unit_iterations, processes=None, batch_size=65536, plot=False,
+              checkpoint=False):
+    # processes caps how many jobs run at once; by default every core gets one
+    jobs = list(jobs)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+
+    mkdir_p(root_dir)
+    print "Starting sweep of %d jobs on %d processes" % (len(jobs), processes)
+
+    # Each job gets a fresh process so that memory from one simulation is never carried into the next
+    finished = run_jobs(jobs, processes, root_dir=root_dir, total_iterations=total_iterations,
+                        unit_iterations=unit_iterations, batch_size=batch_size, plot=plot, checkpoint=checkpoint)
+
+    results = []
+    with open(os.path.join(root_dir, "sweep.csv"), "wb") as f:
+        writer = None
+
+        for job, metrics, elapsed in finished:
+            if writer is None:
+                writer = csv.writer(f, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(["Input", "Seed", "Seconds"] + [metric[0] for metric in metrics])
+
+            writer.writerow([job.input_file, job.seed, "%.1f" % elapsed] +
+                            [metric[1] % metric[2] for metric in metrics])
+            f.flush()
+
+            results.append((job, metrics))
+            print "[%d/%d] Completed %s in %.1fs" % (len(results), len(jobs), get_job_path(root_dir, job), elapsed)
+
+    return results
@@ -0,0 +1,155 @@
+# coding=utf-8
+import csv
+import math
+import os
+import time
+
+import numpy as np
+
+from indset.io import alignment_simulator_grid_loader, alignment_simulator_grid_saver
+from indset.simulate import AlignmentSimulator, ArrayMap
+from indset.simulate.workers import WorkerPool
+from indset.sweep import mkdir_p
+
+
+def _start_replica_worker(input_file, bias, seed, batch_size):
+    # Every worker holds one simulator
+    grid = alignment_simulator_grid_loader(input_file, map_backend=ArrayMap)
+    sim = AlignmentSimulator(grid, bias, seed=seed, batch_size=batch_size)
+
+    def run(iterations):
+        sim.run_iterations(iterations)
+        return grid.flat_map.second_degree_pairs, sim.movements, sim.rounds
+
+    def set_bias(new_bias):
+        sim.bias = new_bias
+
+    return {"run": run,
+            "bias": set_bias,
+            "metrics": lambda _: sim.get_metrics(),
+            "save": lambda filename: alignment_simulator_grid_saver(filename, grid)}
+
+
+class ReplicaExchange(object):
+    """Parallel tempering over a ladder of biases.
+
+    Every bias gets an AlignmentSimulator in its own worker process, all started from the same input grid. After every
+    exchange_interval iterations, neighboring biases i and i + 1 (even pairs and odd pairs in turn) propose to swap
+    configurations, accepted with probability min(1, (b_i / b_j) ** (E_j - E_i)), where E is a configuration's number
+    of second degree neighborhoods. That keeps every chain's stationary distribution, proportional to b ** E, intact.
+
+    Rather than shipping configurations between processes, an accepted swap exchanges the two workers' biases.
+    replica_of_bias[i] is the worker currently running the i-th bias. Iterations, movements and completed rounds are
+    kept per bias rather than per worker: what a worker did between two exchanges counts towards the bias it held.
+    """
+
+    def __init__(self, input_file, biases, seed=0, batch_size=65536):
+        self.biases = sorted(float(b) for b in biases)
+        self.random_state = np.random.RandomState(seed)
+
+        seeds = self.random_state.randint(2 ** 31 - 1, size=len(self.biases)).tolist()
+
+        # Every worker loads its grid before this returns, so that a bad input fails here
+        self.workers = WorkerPool(_start_replica_worker, [(input_file, bias, replica_seed, batch_size)
+                                                          for bias, replica_seed in zip(self.biases, seeds)])
+
+        self.replica_of_bias = range(len(self.biases))
+        self.energies = [None] * len(self.biases)
+
+        self.iterations_run = 0
+        self.movements = [0] * len(self.biases)
+        self.rounds = [0] * len(self.biases)
+        self.worker_counters = [(0, 0)] * len(self.workers)
+        self.exchanges = 0
+        self.swap_attempts = [0] * (len(self.biases) - 1)
+        self.swap_acceptances = [0] * (len(self.biases) - 1)
+
+    def run_iterations(self, iterations, exchange_interval):
+        remaining = iterations
+        while remaining > 0:
+            step = min(exchange_interval, remaining)
+
+            results = self.workers.request_all([(r, "run", step) for r in xrange(len(self.workers))])
+            self.energies = [energy for energy, _, _ in results]
+
+            for i, replica in enumerate(self.replica_of_bias):
+                _, movements, rounds = results[replica]
+                self.movements[i] += movements - self.worker_counters[replica][0]
+                self.rounds[i] += rounds - self.worker_counters[replica][1]
+                self.worker_counters[replica] = (movements, rounds)
+
+            self.iterations_run += step
+            remaining -= step
+
+            self.exchange()
+
+    def exchange(self):
+        # Alternating between the even and the odd pairs lets every swap be decided independently
+        swapped = set()
+        for i in xrange(self.exchanges % 2, len(self.biases) - 1, 2):
+            lower, upper = self.replica_of_bias[i], self.replica_of_bias[i + 1]
+            exponent = self.energies[upper] - self.energies[lower]
+
+            self.swap_attempts[i] += 1
+            log_acceptance = exponent * math.log(self.biases[i] / self.biases[i + 1])
+            if log_acceptance >= 0 or self.random_state.random_sample() < math.exp(log_acceptance):
+                self.replica_of_bias[i], self.replica_of_bias[i + 1] = upper, lower
+                self.swap_acceptances[i] += 1
+                swapped.update((i, i + 1))
+
+        self.workers.request_all([(self.replica_of_bias[i], "bias", self.biases[i]) for i in sorted(swapped)])
+        self.exchanges += 1
+
+    def swap_acceptance_rates(self):
+        return [float(a) / t if t else 0.0 for a, t in zip(self.swap_acceptances, self.swap_attempts)]
+
+    def get_metrics(self, bias_index):
+        # The worker's own counters cover every bias it has held, so they are replaced by those of this bias
+        replica = self.replica_of_bias[bias_index]
+        counters = {"Iterations": self.iterations_run,
+                    "Movements made": self.movements[bias_index],
+                    "Rounds completed:": self.rounds[bias_index]}
+
+        metrics = self.workers.request_all([(replica, "metrics", None)])[0]
+        return [("Replica", "%d", replica)] + [(name, fmt, counters.get(name, value)) for name, fmt, value in metrics]
+
+    def save_grid(self, bias_index, filename):
+        self.workers.request_all([(self.replica_of_bias[bias_index], "save", filename)])
+
+    def close(self):
+        self.workers.close()
+
+
+def run_tempering(input_file, root_dir, biases, seed, total_iterations, exchange_interval, batch_size=65536):
+    # Saves every bias's final grid, a CSV of final metrics per bias and the swap acceptance rate of every pair
+    model_name = os.path.splitext(os.path.basename(input_file))[0]
+    path = os.path.join(root_dir, model_name, "tempering--seed-%d" % seed)
+    mkdir_p(path)
+
+    exchange = ReplicaExchange(input_file, biases, seed=seed, batch_size=batch_size)
+    try:
+        start_time = time.time()
+        exchange.run_iterations(total_iterations, exchange_interval)
+        print "Ran %d replicas for %d iterations in %.1fs" % (len(exchange.biases), total_iterations,
+                                                             time.time() - start_time)
+
+        with open(os.path.join(path, "replicas.csv"), "wb") as f:
+            writer = csv.writer(f, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+            for i, bias in enumerate(exchange.biases):
+                exchange.save_grid(i, os.path.join(path, "lambda-%.2f.txt" % bias))
+
+                metrics = exchange.get_metrics(i)
+                if i == 0:
+                    writer.writerow([metric[0] for metric in metrics])
+                writer.writerow([metric[1] % metric[2] for metric in metrics])
+
+        with open(os.path.join(path, "exchange.csv"), "wb") as f:
+            writer = csv.writer(f, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Lower bias", "Upper bias", "Attempts", "Accepted", "Acceptance rate"])
+            for i, rate in enumerate(exchange.swap_acceptance_rates()):
+                writer.writerow(["%.2f" % exchange.biases[i], "%.2f" % exchange.biases[i + 1],
+                                 exchange.swap_attempts[i], exchange.swap_acceptances[i], "%.4f" % rate])
+    finally:
+        exchange.close()
+
+    return exchange
@@ -1,64 +1,23 @@
-import numpy as np
-import os
-import itertools
-import threading
+import argparse
 
-from indset.simulate import AlignmentSimulator
-from indset.plot import RasterPlotter, VectorPlotter
-from indset.io import alignment_simulator_grid_loader, alignment_simulator_grid_saver, MetricsIO
-
-thread = False
-
-def run_simulation(input_file, root_dir, c, model_name):
-    grid = alignment_simulator_grid_loader(input_file)
-    sim = AlignmentSimulator(grid, c)
-
-    sim_name = "lambda-%.2f" % sim.bias
-
-    print "Starting new simulation: %s. %d simulations currently running." % (sim_name, threading.activeCount() - 1)
-    total_iterations = 100000000
-    i = 0
-    unit_iterations = 10000000
-    plot_iterations = 1 * unit_iterations
-
-    path = os.path.join(root_dir, model_name, sim_name)
-
-    plotter = VectorPlotter(sim, path)
-
-    plotter.plot("%d.pdf" % i)
-
-    if True:
-        while i < total_iterations:
-            sim.run_iterations(unit_iterations)
-            i += unit_iterations
-            print "%s: %d iterations run" % (sim_name, i)
-
-            if i % plot_iterations == 0:
-                plotter.plot("%d.pdf" % i)
-                #alignment_simulator_grid_saver(os.path.join(path, "%d.txt" % i), grid)
-
-    plotter.close()
-
-    print "Simulation completed: %s. %d simulations still running." % (sim_name, threading.activeCount() - 1)
+from indset.sweep import make_jobs, run_sweep
 
 if __name__ == "__main__":
-    input_dir = "input/alignment/generated/"
-    root_dir = "output/alignment/2-25/"
-
-    input_files = ["300particles.txt"]
-
-    for f in input_files:
-        input_file = os.path.join(input_dir, f)
-        model_name = os.path.splitext(os.path.basename(input_file))[0]
-
-        alignment_constants = {20}
-
-        print "Now starting model %s" % model_name
-
-        for c in alignment_constants:
-            if thread:
-                    threading.Thread(target=run_simulation, args=(input_file, root_dir, c, model_name)).start()
-            else:
-                    run_simulation(input_file, root_dir, c, model_name)
-
-        print "Successfully completed model %s" % model_name
+    parser = argparse.ArgumentParser(description="Run AlignmentSimulator bias sweeps across a process pool.")
+    parser.add_argument("input_files", nargs="*", default=["input/alignment/generated/300particles.txt"])
+    parser.add_argument("--root-dir", default="output/alignment/2-25/")
+    parser.add_argument("--biases", type=float, nargs="+", default=[20])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--iterations", type=int, default=100000000)
+    parser.add_argument("--unit-iterations", type=int, default=10000000)
+    parser.add_argument("--processes", type=int, default=None, help="Maximum number of jobs run at once")
+    parser.add_argument("--plot", action="store_true", help="Save a PDF frame after every unit of iterations")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Checkpoint after every unit of iterations and resume interrupted jobs")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.input_files, args.biases, args.seeds)
+    run_sweep(jobs, args.root_dir, args.iterations, args.unit_iterations, processes=args.processes, plot=args.plot,
+              checkpoint=args.checkpoint)
+
+    print "Sweep completed"
@@ -0,0 +1,40 @@
+import argparse
+import sys
+
+from indset.benchmark import run_benchmarks, save_results, load_results, compare_results, format_params, SIZES, \
+    QUICK_SIZES, DENSITIES
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grids, simulators, generation, loading and plotting.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and save the results as JSON")
+    run_parser.add_argument("output")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=None)
+    run_parser.add_argument("--densities", type=float, nargs="+", default=DENSITIES)
+    run_parser.add_argument("--backends", nargs="+", default=["list", "array"], choices=["list", "array"])
+    run_parser.add_argument("--quick", action="store_true", help="Only the small grid sizes")
+    run_parser.add_argument("--no-plots", action="store_true")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files and flag regressions")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Relative slowdown that counts as a regression")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+        results = run_benchmarks(sizes, args.densities, args.backends, plots=not args.no_plots)
+        save_results(args.output, results)
+    else:
+        rows = compare_results(load_results(args.old), load_results(args.new), args.threshold)
+
+        for name, params, old, new, ratio, regressed in rows:
+            print "%-36s %-60s %12.3f %12.3f us/op %6.2fx%s" % (name, format_params(params), old * 1e6, new * 1e6,
+                                                                ratio, "  REGRESSION" if regressed else "")
+
+        regressions = sum(1 for row in rows if row[5])
+        print "%d benchmarks compared, %d regressions" % (len(rows), regressions)
+        sys.exit(1 if regressions else 0)
@@ -1,11 +1,30 @@
+import argparse
+import itertools
 import os
 
 from indset.simulate import AlignmentSimulator
-from indset.generate import generate_random_alignment_grid
+from indset.generate import generate_random_alignment_grid, GridSpec, generate_grid_archive
 from indset.io import alignment_simulator_grid_saver
 
-grid = generate_random_alignment_grid(300, size=(30, 30), simulator_type=AlignmentSimulator)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate random initial configurations for AlignmentSimulator.")
+    parser.add_argument("--particles", type=int, nargs="+", default=[300])
+    parser.add_argument("--size", type=int, nargs=2, default=[30, 30], help="Width and height")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first grid of every particle count")
+    parser.add_argument("--count", type=int, default=1, help="Number of grids per particle count")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", default="input/alignment/generated/300particles.txt",
+                        help="A .txt file for a single grid, otherwise a multi-grid .npz archive")
+    args = parser.parse_args()
 
-in_dir = "input/alignment/generated/"
-grid_name = "300particles"
-alignment_simulator_grid_saver(os.path.join(in_dir, grid_name + ".txt"), grid)
+    size = tuple(args.size)
+    specs = [GridSpec(n, size, seed) for n, seed in
+             itertools.product(args.particles, xrange(args.seed, args.seed + args.count))]
+
+    if len(specs) == 1 and os.path.splitext(args.output)[1] == ".txt":
+        spec = specs[0]
+        grid = generate_random_alignment_grid(spec.n_particles, size=spec.size, simulator_type=AlignmentSimulator,
+                                              seed=spec.seed)
+        alignment_simulator_grid_saver(args.output, grid)
+    else:
+        generate_grid_archive(specs, args.output, args.processes)
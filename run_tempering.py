@@ -0,0 +1,21 @@
+import argparse
+
+from indset.tempering import run_tempering
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run AlignmentSimulator replicas at several biases with replica "
+                                                 "exchange between neighboring biases.")
+    parser.add_argument("input_file", nargs="?", default="input/alignment/generated/300particles.txt")
+    parser.add_argument("--root-dir", default="output/alignment/tempering/")
+    parser.add_argument("--biases", type=float, nargs="+", default=[2, 4, 8, 12, 16, 20])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=100000000)
+    parser.add_argument("--exchange-interval", type=int, default=100000,
+                        help="Iterations each replica runs between swap attempts")
+    args = parser.parse_args()
+
+    exchange = run_tempering(args.input_file, args.root_dir, args.biases, args.seed, args.iterations,
+                             args.exchange_interval)
+
+    for i, rate in enumerate(exchange.swap_acceptance_rates()):
+        print "Swaps between %.2f and %.2f: %.4f accepted" % (exchange.biases[i], exchange.biases[i + 1], rate)